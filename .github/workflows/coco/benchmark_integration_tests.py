@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Benchmark harness for the Coco integration suite.
+
+Runs every DSL scenario K times through run_integration_tests.py (serially, on
+the default slot so timings are not skewed by sibling workers), then derives:
+
+  scenario/<name>/p50_ms, p95_ms   - full lifecycle latency per scenario
+  phase/<span>/p50_ms, p95_ms      - per lifecycle phase (restore, start, ...)
+  restore/docs_per_sec             - bulk restore throughput (only reported when
+                                     documents were bulk-loaded, see bulk_load_seconds)
+
+Each run is appended to a history file (JSON lines). The run is compared with
+a baseline - an explicit JSON file, or the median of the last runs in the
+history with the same configuration - and the script exits non-zero when a
+metric regresses by more than the threshold.
+
+Usage (from the coco project root, like run_integration_tests.py):
+
+    python3 benchmark_integration_tests.py [--repeat K] [--threshold PCT]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+from pathlib import Path
+
+import run_integration_tests as runner
+
+# ================= CONFIGURATION =================
+BENCH_REPEAT = int(os.getenv("BENCH_REPEAT", "3"))
+# Allowed slowdown (percent) before a metric counts as a regression
+BENCH_THRESHOLD = float(os.getenv("BENCH_THRESHOLD", "20"))
+# Latency changes below this are noise, whatever the percentage
+BENCH_MIN_DELTA_MS = float(os.getenv("BENCH_MIN_DELTA_MS", "50"))
+# Number of previous matching runs the baseline is computed from
+BENCH_BASELINE_RUNS = int(os.getenv("BENCH_BASELINE_RUNS", "5"))
+BENCH_HISTORY_FILE = Path(os.getenv("BENCH_HISTORY_FILE", str(runner.PROJECT_ROOT / "benchmark_history.jsonl")))
+# =============================================
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+def latency_metrics(prefix, seconds):
+    """p50/p95 in milliseconds for a list of durations in seconds."""
+    return {
+        f"{prefix}/p50_ms": round(percentile(seconds, 50) * 1000, 1),
+        f"{prefix}/p95_ms": round(percentile(seconds, 95) * 1000, 1),
+    }
+
+def bench_config():
+    """Settings that make runs comparable with each other."""
+    return {
+        "reset_mode": runner.RESET_MODE,
+        "persistent_server": runner.PERSISTENT_SERVER,
+        "skip_unchanged": runner.RESTORE_SKIP_UNCHANGED,
+        "warm_start": runner.WARM_START,
+    }
+
+def bulk_load_seconds(spans):
+    """
+    Wall time covered by (start, duration) spans. The indices of a reset are
+    loaded in parallel, so overlapping spans count once.
+    """
+    total, end = 0.0, None
+    for start, duration in sorted(spans):
+        stop = start + duration
+        if end is None or start > end:
+            total += duration
+            end = stop
+        elif stop > end:
+            total += stop - end
+            end = stop
+    return total
+
+def run_benchmark(dsl_files, loadgen_bin, repeat):
+    """
+    Run each scenario `repeat` times. Returns the metrics dict, or None if a
+    scenario failed (timings of a failing run are meaningless).
+    """
+    runner.TIMINGS_FILE.write_text("")
+    scenario_times = {}
+
+    try:
+        for k in range(1, repeat + 1):
+            for dsl_file in dsl_files:
+                name = str(dsl_file.relative_to(runner.TESTS_DIR))
+                runner.log(f"BENCHMARK [{k}/{repeat}]: {name}", level="START")
+                start = time.time()
+                if not runner.run_single_dsl_test(dsl_file, loadgen_bin):
+                    runner.log(f"Scenario failed, aborting benchmark: {name}", level="ERROR")
+                    return None
+                scenario_times.setdefault(name, []).append(time.time() - start)
+    finally:
+        if runner.PERSISTENT_SERVER:
+            runner.stop_coco_server()
+
+    phases = {}
+    restored_docs = 0
+    # Per-index bulk loads that indexed documents; snapshot restores and
+    # indices kept by --skip-unchanged take time but load nothing
+    bulk_spans = []
+    with open(runner.TIMINGS_FILE) as f:
+        for line in f:
+            record = json.loads(line)
+            phases.setdefault(record["span"], []).append(record["duration"])
+            if record["span"] == "restore.index" and record.get("docs"):
+                restored_docs += record["docs"]
+                bulk_spans.append((record["start"], record["duration"]))
+
+    metrics = {}
+    for name, seconds in sorted(scenario_times.items()):
+        metrics.update(latency_metrics(f"scenario/{name}", seconds))
+    for name, seconds in sorted(phases.items()):
+        metrics.update(latency_metrics(f"phase/{name}", seconds))
+    bulk_time = bulk_load_seconds(bulk_spans)
+    if restored_docs and bulk_time:
+        metrics["restore/docs_per_sec"] = round(restored_docs / bulk_time, 1)
+    return metrics
+
+def load_history(path):
+    """All recorded runs, oldest first."""
+    if not path.exists():
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def baseline_from_history(history, config, runs):
+    """Median of every metric over the last `runs` runs with the same config."""
+    matching = [run["metrics"] for run in history if run.get("config") == config][-runs:]
+    if not matching:
+        return {}
+    keys = set().union(*matching)
+    return {
+        key: statistics.median(run[key] for run in matching if key in run)
+        for key in keys
+    }
+
+def compare(baseline, current, threshold, min_delta_ms):
+    """
+    Print a baseline/current table. Returns the list of regressed metrics.
+    """
+    regressions = []
+    print(f"  {'METRIC':<48} {'BASELINE':>10} {'CURRENT':>10} {'CHANGE':>8}")
+    for key in sorted(current):
+        value = current[key]
+        base = baseline.get(key)
+        if base is None:
+            print(f"  {key:<48} {'-':>10} {value:>10.1f} {'new':>8}")
+            continue
+        change = (value - base) / base * 100 if base else 0.0
+        higher_is_better = key.endswith("_per_sec")
+        worse = -change if higher_is_better else change
+        regressed = worse > threshold
+        if regressed and key.endswith("_ms") and abs(value - base) < min_delta_ms:
+            regressed = False
+        mark = "  REGRESSION" if regressed else ""
+        print(f"  {key:<48} {base:>10.1f} {value:>10.1f} {change:>+7.1f}%{mark}")
+        if regressed:
+            regressions.append(key)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Coco integration suite")
+    parser.add_argument("--repeat", type=int, default=BENCH_REPEAT,
+                        help="Runs per scenario")
+    parser.add_argument("--threshold", type=float, default=BENCH_THRESHOLD,
+                        help="Regression threshold in percent")
+    parser.add_argument("--history", type=Path, default=BENCH_HISTORY_FILE,
+                        help="JSON-lines file the results are appended to")
+    parser.add_argument("--baseline", type=Path,
+                        help="JSON file with baseline metrics (default: median of recent history)")
+    parser.add_argument("--write-baseline", type=Path,
+                        help="Also write this run's metrics as a baseline file")
+    parser.add_argument("--scenario", action="append", default=[],
+                        help="Only benchmark scenarios whose path contains this string (repeatable)")
+    args = parser.parse_args()
+
+    runner.check_project_root()
+    loadgen_bin = runner.resolve_loadgen()
+    dsl_files = sorted(runner.TESTS_DIR.glob("**/*.dsl"))
+    if args.scenario:
+        dsl_files = [f for f in dsl_files if any(s in str(f.relative_to(runner.TESTS_DIR)) for s in args.scenario)]
+    if not dsl_files:
+        runner.log("No .dsl files to benchmark.", level="WARN")
+        return
+
+    runner.log(f"Benchmarking {len(dsl_files)} scenario(s) x {args.repeat} run(s).", level="INFO")
+    metrics = run_benchmark(dsl_files, loadgen_bin, args.repeat)
+    if metrics is None:
+        sys.exit(1)
+
+    config = bench_config()
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+    else:
+        baseline = baseline_from_history(load_history(args.history), config, BENCH_BASELINE_RUNS)
+
+    record = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "commit": os.getenv("GITHUB_SHA", ""),
+        "repeat": args.repeat,
+        "config": config,
+        "metrics": metrics,
+    }
+    with open(args.history, "a") as f:
+        f.write(json.dumps(record) + "\n")
+    if args.write_baseline:
+        args.write_baseline.write_text(json.dumps(metrics, indent=2) + "\n")
+
+    runner.log(f"Benchmark results (threshold {args.threshold:.0f}%, history {args.history.name}):", level="INFO")
+    regressions = compare(baseline, metrics, args.threshold, BENCH_MIN_DELTA_MS)
+    if not baseline:
+        runner.log("No baseline yet; this run becomes the reference.", level="INFO")
+    elif regressions:
+        runner.log(f"{len(regressions)} metric(s) regressed beyond {args.threshold:.0f}%: {regressions}", level="ERROR")
+        sys.exit(1)
+    else:
+        runner.log("No regressions.", level="SUCCESS")
+
+if __name__ == "__main__":
+    main()
@@ -4,11 +4,22 @@ import os
 import sys
 import shutil
 import subprocess
+import re
 import time
+import json
 import socket
 import signal
-import base64
+import argparse
+import threading
+import urllib.request
+import urllib.error
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
 from pathlib import Path
+from xml.etree import ElementTree
 
 # ================= CONFIGURATION =================
 LOG_IDENTIFIER = 'COCO_TEST'
@@ -20,9 +31,12 @@ PROJECT_ROOT = Path(os.getcwd()).resolve()
 # Note: Ensure this filename matches your actual file (import_data_raw.py vs import_es_raw.py)
 TESTS_DIR = PROJECT_ROOT / "tests"
 COCO_BIN = PROJECT_ROOT / "bin" / "coco"
+COCO_CONFIG = PROJECT_ROOT / "coco.yml"
 SERVER_LOG_FILE = PROJECT_ROOT / "coco_server.log"
 PID_FILE = PROJECT_ROOT / "integration_test_coco.pid"
 SNAPSHOT_SCRIPT = TESTS_DIR / "snapshot" / "import_data_raw.py"
+# Exit code of SNAPSHOT_SCRIPT when the data was imported but --save-snapshot failed
+SNAPSHOT_NOT_SAVED_EXIT = 3
 
 # Easysearch Server
 # Defaults to https://localhost:9200 if not set in ENV
@@ -37,22 +51,218 @@ PORT_RPC = 2900
 # Max wait time for start/stop (3 minutes)
 SERVER_WAIT_TIMEOUT = 180 
 
+# Readiness probing: exponential backoff between probes (seconds)
+READY_PROBE_MIN = 0.05
+READY_PROBE_MAX = 1.0
+# Optional line in the Coco server log that marks the server as started
+COCO_READY_LOG_MARKER = os.getenv("COCO_READY_LOG_MARKER", "")
+
+# Data reset strategy between scenarios:
+#   import   - delete coco_* and re-import every index from tests/snapshot/repo
+#   snapshot - import once, save an Easysearch fs snapshot, then restore it per scenario
+RESET_MODE = os.getenv("RESET_MODE", "import").lower()
+# Import mode only: keep indices that still match the snapshot manifest
+# checksums and were not written to by the previous scenario
+RESTORE_SKIP_UNCHANGED = os.getenv("RESTORE_SKIP_UNCHANGED", "false").lower() == "true"
+# Easysearch was booted from a pre-built data directory with the fixtures loaded:
+# the first reset keeps the indices that still match the manifest checksums
+# and only imports the others over HTTP
+WARM_START = os.getenv("WARM_START", "false").lower() == "true"
+
+# Keep one Coco process alive for the whole suite and only reset data between
+# scenarios. A crashed or unresponsive server is restarted automatically.
+PERSISTENT_SERVER = os.getenv("PERSISTENT_SERVER", "false").lower() == "true"
+# Liveness probe used in persistent mode (any HTTP response counts as alive)
+COCO_HEALTH_PATH = os.getenv("COCO_HEALTH_PATH", "/health")
+COCO_HEALTH_TIMEOUT = 5
+# Cache invalidation after an in-place data reset. Without one of these the
+# running server could serve entities cached before the reset, so persistent
+# mode restarts it after every reset and only reuses it across batches that
+# restored nothing.
+#   COCO_CACHE_RESET_URL    - endpoint to POST to (e.g. http://127.0.0.1:9000/...)
+#   COCO_CACHE_RESET_SIGNAL - signal name sent to the server process (e.g. SIGHUP)
+COCO_CACHE_RESET_URL = os.getenv("COCO_CACHE_RESET_URL", "")
+COCO_CACHE_RESET_SIGNAL = os.getenv("COCO_CACHE_RESET_SIGNAL", "")
+
+# Parallel execution: number of worker slots. Each slot runs its own Coco
+# instance on allocated ports against its own index prefix (coco_s<N>_).
+TEST_WORKERS = int(os.getenv("TEST_WORKERS", "1"))
+SLOTS_DIR = PROJECT_ROOT / ".integration_slots"
+DEFAULT_INDEX_PREFIX = "coco_"
+# Index template registered by coco.yml (renamed per slot)
+INDEX_TEMPLATE = "coco-search"
+
+# Scenario metadata (indices read / mutated, required scenarios).
+# Scenarios without an entry are assumed to mutate everything.
+SCENARIOS_FILE = TESTS_DIR / "scenarios.json"
+# Marker for "every fixture index"
+ALL_INDICES = "*"
+# Restore verification after each reset, against tests/snapshot/repo/manifest.json:
+#   count    - the live _count of every pristine index must match the manifest
+#   checksum - also compare an order-independent hash of all documents
+#   off      - skip verification
+VERIFY_MODE = os.getenv("VERIFY_MODE", "count").lower()
+VERIFY_WORKERS = 8
+# Keys listed per index when verification fails
+VERIFY_DIFF_KEYS = 5
+
+# Failure log capture: logs are read from the end, bounded by bytes and lines,
+# and limited to what was written since the current scenario started
+ES_LOG_FILE = Path(os.getenv("ES_LOG_FILE", str(Path.home() / "easysearch" / "logs" / "easysearch.log")))
+LOG_TAIL_BYTES = int(os.getenv("LOG_TAIL_BYTES", str(1024 * 1024)))
+LOG_TAIL_LINES = int(os.getenv("LOG_TAIL_LINES", "200"))
+LOG_CONTEXT_LINES = 5
+LOG_MAX_WINDOWS = 20
+LOG_PROBLEM_PATTERN = re.compile(r"\[(ERR|WRN|ERROR|WARN)\]|\b(ERROR|WARN|WARNING|FATAL|PANIC)\b")
+
+# Results: by default every scenario runs and the report lists all failures;
+# FAIL_FAST stops scheduling new scenarios after the first one
+FAIL_FAST = os.getenv("FAIL_FAST", "false").lower() == "true"
+REPORT_DIR = Path(os.getenv("REPORT_DIR", str(PROJECT_ROOT)))
+REPORT_JSON = "integration_results.json"
+REPORT_JUNIT = "integration_results.xml"
+# Lines of loadgen output kept in the report for each failed scenario
+REPORT_LOG_LINES = int(os.getenv("REPORT_LOG_LINES", "60"))
+
+# Phase timings: one JSON line per span (runner phases, plus per-index and
+# per-bulk-batch spans written by the import script), summarized at the end
+TIMINGS_FILE = Path(os.getenv("TIMINGS_FILE", str(PROJECT_ROOT / "integration_timings.jsonl")))
+_timings_lock = threading.Lock()
+
+@dataclass
+class Slot:
+    """Isolated execution environment for one scenario at a time."""
+    id: int
+    port_http: int
+    port_rpc: int
+    index_prefix: str
+    pid_file: Path
+    log_file: Path
+    # Generated coco.yml (None = use the project's default config)
+    config_file: Path = None
+    # Runner/loadgen output of this slot (None = inherit stdout)
+    output_file: Path = None
+    # Handle of the running Coco process (used to detect crashes)
+    proc: subprocess.Popen = None
+    snapshot_saved: bool = False
+    resets: int = 0
+    # Byte offsets of the logs when the current scenario started (see mark_logs)
+    log_marks: dict = field(default_factory=dict)
+    # Fixture indices modified since their last reset (ALL_INDICES = unknown state)
+    dirty: set = field(default_factory=lambda: {ALL_INDICES})
+
+    @property
+    def name(self):
+        return f"slot-{self.id}"
+
+    @property
+    def coco_server(self):
+        return f"http://127.0.0.1:{self.port_http}"
+
+@dataclass
+class ScenarioResult:
+    """Outcome of one scenario: passed, failed or skipped."""
+    name: str
+    status: str
+    duration: float = 0.0
+    # Tail of the captured output (failures only)
+    log: str = ""
+
+    @property
+    def passed(self):
+        return self.status == "passed"
+
+DEFAULT_SLOT = Slot(0, PORT_HTTP, PORT_RPC, DEFAULT_INDEX_PREFIX, PID_FILE, SERVER_LOG_FILE)
+
+# Slot of the current worker thread (used to tag log lines)
+_log_context = threading.local()
+
 # ================= HELPER FUNCTIONS =================
 
 def log(msg, level="INFO"):
     """Print a formatted log message."""
-    print(f"[{LOG_IDENTIFIER}_{level}]: {msg}", flush=True)
+    tag = getattr(_log_context, "tag", "")
+    print(f"[{LOG_IDENTIFIER}_{level}]{tag}: {msg}", flush=True)
 
-def run_cmd(command, check=True):
-    """Wrapper to run shell commands using subprocess."""
+def record_span(name, start, duration, status="ok", slot=DEFAULT_SLOT, **attrs):
+    """Append one timing span to TIMINGS_FILE."""
+    record = {
+        "span": name,
+        "scenario": getattr(_log_context, "scenario", ""),
+        "slot": slot.name,
+        "start": round(start, 3),
+        "duration": round(duration, 3),
+        "status": status,
+        **attrs,
+    }
+    with _timings_lock, open(TIMINGS_FILE, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+@contextmanager
+def span(name, slot=DEFAULT_SLOT, **attrs):
+    """Time a phase of the test lifecycle and record it as a span."""
+    start = time.time()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        duration = time.time() - start
+        record_span(name, start, duration, status, slot, **attrs)
+        log(f"{name} took {duration:.2f}s", level="DEBUG")
+
+def run_cmd(command, check=True, slot=DEFAULT_SLOT, env=None, capture=False):
+    """
+    Wrapper to run shell commands using subprocess.
+    With capture, the output is streamed through line by line and its last
+    LOG_TAIL_LINES lines are kept in result.stdout (or the exception's output).
+    """
     log(f"Executing: {command}", level="DEBUG")
     try:
-        result = subprocess.run(
-            command, 
-            shell=True, 
-            check=check, 
-            text=True
-        )
+        if capture:
+            tail = deque(maxlen=LOG_TAIL_LINES)
+            out = open(slot.output_file, "a") if slot.output_file else sys.stdout
+            try:
+                with subprocess.Popen(
+                    command,
+                    shell=True,
+                    text=True,
+                    errors="replace",
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    env=env
+                ) as proc:
+                    for line in proc.stdout:
+                        out.write(line)
+                        tail.append(line)
+                    out.flush()
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+            result = subprocess.CompletedProcess(command, proc.returncode, "".join(tail))
+            if check:
+                result.check_returncode()
+        elif slot.output_file:
+            with open(slot.output_file, "a") as out:
+                result = subprocess.run(
+                    command,
+                    shell=True,
+                    check=check,
+                    text=True,
+                    stdout=out,
+                    stderr=subprocess.STDOUT,
+                    env=env
+                )
+        else:
+            result = subprocess.run(
+                command, 
+                shell=True, 
+                check=check, 
+                text=True,
+                env=env
+            )
         return result
     except subprocess.CalledProcessError as e:
         log(f"Command failed: [{command}]", level="ERROR")
@@ -60,21 +270,88 @@ def run_cmd(command, check=True):
         
         # Dump Easysearch logs if in CI
         if os.getenv("GITHUB_ACTIONS") == "true":
-            # Adjusted path based on typical CI setups
-            es_log = Path.home() / "easysearch" / "logs" / "easysearch.log"
-            if es_log.exists():
-                log("--- Dumping Easysearch logs ---", level="DEBUG")
-                print(es_log.read_text(errors='replace'))
-                log("--- End of logs ---", level="DEBUG")
+            dump_log("Easysearch logs", ES_LOG_FILE, slot)
         
+        # Dump this slot's command output when it was redirected
+        if slot.output_file:
+            dump_log(f"{slot.name} output", slot.output_file, slot)
+
         # Dump Coco Server logs if available
-        if SERVER_LOG_FILE.exists():
-            log("--- Dumping Coco Server logs ---", level="DEBUG")
-            print(SERVER_LOG_FILE.read_text(errors='replace'))
-            log("--- End of logs ---", level="DEBUG")
+        dump_log("Coco Server logs", slot.log_file, slot)
 
         raise e
 
+# ================= LOG CAPTURE =================
+
+def mark_logs(slot):
+    """Remember where the slot's logs end, so later dumps only show what follows."""
+    for path in (slot.log_file, slot.output_file, ES_LOG_FILE):
+        if path:
+            slot.log_marks[path] = path.stat().st_size if path.exists() else 0
+
+def read_log_slice(path, start=0, max_bytes=LOG_TAIL_BYTES):
+    """
+    Last lines of `path` after byte offset `start`, reading at most max_bytes
+    from the end of the file. A file truncated below `start` (server restart)
+    is read from the beginning.
+    """
+    if not path or not path.exists():
+        return []
+    size = path.stat().st_size
+    if start > size:
+        start = 0
+    offset = max(start, size - max_bytes)
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(size - offset)
+    lines = data.decode("utf-8", errors="replace").splitlines()
+    # The first line is partial when reading did not start at the slice start
+    if offset > start and lines:
+        lines = lines[1:]
+    return lines
+
+def problem_windows(lines, context=LOG_CONTEXT_LINES):
+    """ERROR/WARN lines with `context` lines around them, overlapping windows merged."""
+    windows = []
+    for i, line in enumerate(lines):
+        if LOG_PROBLEM_PATTERN.search(line):
+            lo, hi = max(0, i - context), min(len(lines), i + context + 1)
+            if windows and lo <= windows[-1][1]:
+                windows[-1][1] = hi
+            else:
+                windows.append([lo, hi])
+    return [lines[lo:hi] for lo, hi in windows]
+
+def log_excerpt(path, slot=DEFAULT_SLOT, max_lines=LOG_TAIL_LINES):
+    """
+    Bounded excerpt of the part of a log written since mark_logs(slot): the
+    ERROR/WARN windows scrolled out of the tail, then the last lines.
+    Returns "" if there is nothing.
+    """
+    lines = read_log_slice(path, slot.log_marks.get(path, 0))
+    if not lines:
+        return ""
+    parts = []
+    windows = problem_windows(lines[:-max_lines])
+    if windows:
+        parts.append("... earlier ERROR/WARN lines ...")
+        for window in windows[-LOG_MAX_WINDOWS:]:
+            parts.extend(window)
+            parts.append("...")
+    tail = lines[-max_lines:]
+    parts.append(f"... last {len(tail)} of {len(lines)} lines ...")
+    parts.extend(tail)
+    return "\n".join(parts)
+
+def dump_log(title, path, slot=DEFAULT_SLOT):
+    """Print a bounded excerpt of a log (see log_excerpt)."""
+    excerpt = log_excerpt(path, slot)
+    if not excerpt:
+        return
+    log(f"--- Dumping {title} ({path}) ---", level="DEBUG")
+    print(excerpt)
+    log("--- End of logs ---", level="DEBUG")
+
 def resolve_loadgen():
     """Locate the 'loadgen' binary."""
     if shutil.which("loadgen"):
@@ -101,14 +378,22 @@ def check_project_root():
 def check_port(port):
     """Return True if port is open (accepting connections)."""
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.settimeout(1) # Short timeout for individual check
+        s.settimeout(0.5) # Short timeout for individual check
         return s.connect_ex(('127.0.0.1', port)) == 0
 
+def probe_delays():
+    """Yield exponentially growing sleep intervals between readiness probes."""
+    delay = READY_PROBE_MIN
+    while True:
+        yield delay
+        delay = min(delay * 2, READY_PROBE_MAX)
+
 def wait_for_ports(ports, target_state='open', timeout=30):
     """
     Wait for ports to match the target state ('open' or 'closed').
     """
     start_time = time.time()
+    delays = probe_delays()
     while time.time() - start_time < timeout:
         all_match = True
         for port in ports:
@@ -121,12 +406,76 @@ def wait_for_ports(ports, target_state='open', timeout=30):
         if all_match:
             return True
         
-        time.sleep(1)
+        time.sleep(next(delays))
         
     log(f"Timeout ({timeout}s) waiting for ports {ports} to be {target_state}", level="WARN")
     return False
 
-def start_coco_server():
+def http_responds(url, timeout=2):
+    """Return True if the URL answers with any HTTP status."""
+    try:
+        with urllib.request.urlopen(url, timeout=timeout):
+            return True
+    except urllib.error.HTTPError:
+        return True
+    except Exception:
+        return False
+
+class LogWatcher:
+    """Incrementally scan a growing log file for a marker string."""
+
+    def __init__(self, path, marker):
+        self.path = path
+        self.marker = marker.encode("utf-8")
+        self.offset = 0
+        self.tail = b""
+
+    def seen(self):
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(self.offset)
+                chunk = f.read()
+        except FileNotFoundError:
+            return False
+        self.offset += len(chunk)
+        # Keep the end of the previous chunk so a marker split across reads is found
+        data = self.tail + chunk
+        self.tail = data[-len(self.marker):]
+        return self.marker in data
+
+def wait_for_coco_ready(slot, timeout=SERVER_WAIT_TIMEOUT):
+    """
+    Wait until the slot's Coco Server is ready: process running, both ports
+    open, HTTP answering on COCO_HEALTH_PATH and (optionally) the
+    COCO_READY_LOG_MARKER line written. Fails immediately if the process exits.
+    Returns the startup latency in seconds, or None on failure.
+    """
+    start_time = time.time()
+    delays = probe_delays()
+    watcher = LogWatcher(slot.log_file, COCO_READY_LOG_MARKER) if COCO_READY_LOG_MARKER else None
+    marker_seen = watcher is None
+    ports_open = False
+
+    while time.time() - start_time < timeout:
+        if slot.proc is not None and slot.proc.poll() is not None:
+            log(f"Coco Server exited during startup with code {slot.proc.returncode}.", level="ERROR")
+            return None
+
+        if not marker_seen:
+            marker_seen = watcher.seen()
+        if not ports_open:
+            ports_open = check_port(slot.port_http) and check_port(slot.port_rpc)
+
+        if marker_seen and ports_open and http_responds(f"{slot.coco_server}{COCO_HEALTH_PATH}"):
+            return time.time() - start_time
+
+        time.sleep(next(delays))
+
+    log(f"Timeout ({timeout}s) waiting for Coco Server readiness "
+        f"(ports open: {ports_open}, log marker seen: {marker_seen})", level="WARN")
+    return None
+
+def start_coco_server(slot=DEFAULT_SLOT):
     """Start the coco binary in the background."""
     if COCO_BIN.exists():
         log(f"Coco binary found at {COCO_BIN}", level="DEBUG")
@@ -135,38 +484,49 @@ def start_coco_server():
         sys.exit(1)
 
     log("Starting Coco Server...", level="STEP")
+
+    command = [str(COCO_BIN)]
+    env = None
+    if slot.config_file:
+        command += ["-config", str(slot.config_file)]
+        env = dict(os.environ,
+                   WEB_BINDING=f"0.0.0.0:{slot.port_http}",
+                   API_BINDING=f"0.0.0.0:{slot.port_rpc}")
     
     # Open log file for appending (overwrite for new test run)
-    with open(SERVER_LOG_FILE, "w") as log_f:
+    slot.log_marks[slot.log_file] = 0
+    with open(slot.log_file, "w") as log_f:
         # Start process
         proc = subprocess.Popen(
-            [str(COCO_BIN)],
+            command,
             stdout=log_f,
             stderr=subprocess.STDOUT,
             cwd=PROJECT_ROOT,
+            env=env,
             start_new_session=True # Detach from parent
         )
 
     # Save PID
-    PID_FILE.write_text(str(proc.pid))
+    slot.pid_file.write_text(str(proc.pid))
+    slot.proc = proc
     
-    # Wait for ports to open
-    if wait_for_ports([PORT_HTTP, PORT_RPC], 'open', timeout=SERVER_WAIT_TIMEOUT):
-        log("Coco Server is UP.", level="SUCCESS")
+    # Wait for the server to become ready
+    startup = wait_for_coco_ready(slot)
+    if startup is not None:
+        log(f"Coco Server is UP ({startup:.2f}s).", level="SUCCESS")
     else:
-        log("Failed to start Coco Server (Timeout).", level="ERROR")
-        if SERVER_LOG_FILE.exists():
-            print(SERVER_LOG_FILE.read_text())
-        stop_coco_server() # Attempt cleanup
-        sys.exit(1)
+        log("Failed to start Coco Server.", level="ERROR")
+        dump_log("Coco Server logs", slot.log_file, slot)
+        stop_coco_server(slot) # Attempt cleanup
+        raise RuntimeError("Coco Server failed to start")
 
-def stop_coco_server():
+def stop_coco_server(slot=DEFAULT_SLOT):
     """Stop the coco server using the PID file."""
-    if not PID_FILE.exists():
+    if not slot.pid_file.exists():
         return
 
     try:
-        pid_str = PID_FILE.read_text().strip()
+        pid_str = slot.pid_file.read_text().strip()
         if not pid_str:
             return
             
@@ -180,7 +540,7 @@ def stop_coco_server():
             log("Process already gone.", level="DEBUG")
         
         # Wait for ports to close
-        if not wait_for_ports([PORT_HTTP, PORT_RPC], 'closed', timeout=SERVER_WAIT_TIMEOUT):
+        if not wait_for_ports([slot.port_http, slot.port_rpc], 'closed', timeout=SERVER_WAIT_TIMEOUT):
             log("Warning: Server ports did not close in time. Sending SIGKILL...", level="WARN")
             try:
                 os.kill(pid, signal.SIGKILL)
@@ -193,69 +553,644 @@ def stop_coco_server():
         log(f"Error stopping server: {e}", level="ERROR")
     finally:
         # Clean up PID file
-        if PID_FILE.exists():
-            PID_FILE.unlink()
+        if slot.pid_file.exists():
+            slot.pid_file.unlink()
+        if slot.proc is not None:
+            # Reap the child so it does not linger as a zombie
+            try:
+                slot.proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                pass
+            slot.proc = None
+
+def coco_server_healthy(slot=DEFAULT_SLOT):
+    """
+    Return True if the Coco process is alive and answers HTTP requests.
+    """
+    if slot.proc is None or slot.proc.poll() is not None:
+        if slot.proc is not None:
+            log(f"Coco Server exited with code {slot.proc.returncode}.", level="WARN")
+        return False
+
+    url = f"{slot.coco_server}{COCO_HEALTH_PATH}"
+    try:
+        with urllib.request.urlopen(url, timeout=COCO_HEALTH_TIMEOUT):
+            return True
+    except urllib.error.HTTPError:
+        # Any HTTP status means the server is responsive
+        return True
+    except Exception as e:
+        log(f"Coco Server health probe failed: {e}", level="WARN")
+        return False
+
+def invalidate_coco_caches(slot=DEFAULT_SLOT):
+    """
+    Ask a running Coco Server to drop cached state after an in-place data reset.
+    Returns False if no reset mechanism is configured or it failed.
+    """
+    if not COCO_CACHE_RESET_URL and not COCO_CACHE_RESET_SIGNAL:
+        log("No cache reset configured (COCO_CACHE_RESET_URL / COCO_CACHE_RESET_SIGNAL).", level="DEBUG")
+        return False
+
+    try:
+        if COCO_CACHE_RESET_SIGNAL:
+            os.kill(slot.proc.pid, getattr(signal, COCO_CACHE_RESET_SIGNAL.upper()))
+        if COCO_CACHE_RESET_URL:
+            req = urllib.request.Request(COCO_CACHE_RESET_URL, data=b"", method="POST")
+            with urllib.request.urlopen(req, timeout=COCO_HEALTH_TIMEOUT):
+                pass
+    except Exception as e:
+        log(f"Cache reset failed: {e}", level="WARN")
+        return False
+    return True
+
+def ensure_coco_server(slot=DEFAULT_SLOT, data_reset=True):
+    """
+    Persistent mode: reuse the running server when it is healthy and, if the
+    data was reset under it, its caches could be invalidated; otherwise fall
+    back to a full restart.
+    """
+    if coco_server_healthy(slot) and (not data_reset or invalidate_coco_caches(slot)):
+        log("Reusing running Coco Server.", level="INFO")
+        return
+
+    log("Coco Server not reusable, restarting...", level="WARN")
+    stop_coco_server(slot)
+    start_coco_server(slot)
+
+# ================= WORKER SLOTS =================
+
+def allocate_port():
+    """Ask the OS for a free TCP port."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def render_slot_config(slot):
+    """
+    Write a coco.yml for the slot: same settings as the project config but with
+    the slot's index prefix, its own index template name (templates are
+    cluster-wide and overridden on boot, so slots must not share one) and its
+    own data/log directories.
+    Ports are passed through the WEB_BINDING / API_BINDING environment variables.
+    """
+    slot_dir = slot.config_file.parent
+    text = COCO_CONFIG.read_text()
+    text = text.replace(f'"{DEFAULT_INDEX_PREFIX}', f'"{slot.index_prefix}')
+    text = text.replace(f'"{INDEX_TEMPLATE}":', f'"{INDEX_TEMPLATE}-s{slot.id}":')
+    text = "\n".join(
+        line for line in text.splitlines()
+        if not line.startswith(("path.data:", "path.logs:"))
+    )
+    text = f"path.data: {slot_dir / 'data'}\npath.logs: {slot_dir / 'log'}\n\n{text}\n"
+    slot.config_file.write_text(text)
+
+def create_slots(count):
+    """
+    Build the worker slots. A single worker keeps the default layout
+    (ports 9000/2900, coco_* indices, files in the project root).
+    """
+    if count <= 1:
+        return [DEFAULT_SLOT]
+
+    slots = []
+    for i in range(1, count + 1):
+        slot_dir = SLOTS_DIR / f"slot-{i}"
+        slot_dir.mkdir(parents=True, exist_ok=True)
+        slot = Slot(
+            id=i,
+            port_http=allocate_port(),
+            port_rpc=allocate_port(),
+            index_prefix=f"coco_s{i}_",
+            pid_file=slot_dir / "coco.pid",
+            log_file=slot_dir / "coco_server.log",
+            config_file=slot_dir / "coco.yml",
+            output_file=slot_dir / "output.log",
+        )
+        render_slot_config(slot)
+        slot.output_file.write_text("")
+        log(f"{slot.name}: ports {slot.port_http}/{slot.port_rpc}, indices {slot.index_prefix}*, dir {slot_dir}", level="INFO")
+        slots.append(slot)
+    return slots
+
+# ================= DATA RESET =================
+
+def reset_data(slot=DEFAULT_SLOT, indices=ALL_INDICES):
+    """
+    Restore the pristine Easysearch state according to RESET_MODE, either for
+    every fixture index or only for the given list of (exported) index names.
+    """
+    command = f"python3 {SNAPSHOT_SCRIPT}"
+    if slot.index_prefix != DEFAULT_INDEX_PREFIX:
+        command += f" --index-prefix {slot.index_prefix}"
+    # The baseline snapshot must be taken from a complete restore
+    if RESET_MODE == "snapshot" and not slot.snapshot_saved:
+        indices = ALL_INDICES
+    if indices != ALL_INDICES:
+        command += f" --indices {','.join(indices)}"
+
+    # The import script appends its per-index / per-batch spans to the same file
+    env = dict(os.environ,
+               TIMINGS_FILE=str(TIMINGS_FILE),
+               TIMINGS_SCENARIO=getattr(_log_context, "scenario", ""),
+               TIMINGS_SLOT=slot.name)
+
+    # Until the reset succeeds the state of the slot is unknown
+    slot.dirty = {ALL_INDICES}
+    # Fixture indices present at boot (WARM_START) are kept if they still match
+    if (WARM_START and not slot.resets) or (RESET_MODE != "snapshot" and RESTORE_SKIP_UNCHANGED):
+        command += " --skip-unchanged"
+    slot.resets += 1
+    if RESET_MODE == "snapshot":
+        if slot.snapshot_saved:
+            run_cmd(f"{command} --from-snapshot", check=True, slot=slot, env=env)
+        else:
+            result = run_cmd(f"{command} --save-snapshot", check=False, slot=slot, env=env)
+            if result.returncode == SNAPSHOT_NOT_SAVED_EXIT:
+                log(f"{slot.name}: baseline snapshot not saved, the next reset imports from files again",
+                    level="WARN")
+            else:
+                result.check_returncode()
+                slot.snapshot_saved = True
+    else:
+        run_cmd(command, check=True, slot=slot, env=env)
+    return indices
+
+# ================= SCHEDULING =================
+
+def load_scenario_meta(dsl_files):
+    """
+    Read SCENARIOS_FILE and return {dsl_file: meta} with defaults filled in:
+      reads    - indices that must be pristine when the scenario starts
+      mutates  - indices the scenario writes to, plus the file's server_writes
+                 (indices Coco Server writes to on its own while any scenario runs)
+      requires - scenarios (relative paths) that must pass before this one
+    """
+    entries, server_writes = {}, set()
+    if SCENARIOS_FILE.exists():
+        spec = json.loads(SCENARIOS_FILE.read_text())
+        entries, server_writes = spec.get("scenarios", {}), set(spec.get("server_writes", []))
+    known = {str(f.relative_to(TESTS_DIR)) for f in dsl_files}
+    for name in sorted(set(entries) - known):
+        log(f"{SCENARIOS_FILE.name}: no scenario named {name}", level="WARN")
+
+    metas = {}
+    for dsl_file in dsl_files:
+        entry = entries.get(str(dsl_file.relative_to(TESTS_DIR)), {})
+        metas[dsl_file] = {
+            "reads": set(entry.get("reads", [ALL_INDICES])),
+            "mutates": set(entry.get("mutates", [ALL_INDICES])) | server_writes,
+            "requires": [TESTS_DIR / name for name in entry.get("requires", [])],
+        }
+    return metas
+
+def order_scenarios(dsl_files, metas):
+    """
+    Order scenarios so that each one comes after the scenarios it requires,
+    keeping the discovery order otherwise. Requirements that are not part of
+    `dsl_files` (e.g. when rerunning failures) are not pulled in.
+    """
+    ordered, visiting, selected = [], set(), set(dsl_files)
+
+    def visit(dsl_file):
+        if dsl_file in ordered:
+            return
+        if dsl_file in visiting:
+            raise ValueError(f"Circular scenario requirement involving {dsl_file.relative_to(TESTS_DIR)}")
+        visiting.add(dsl_file)
+        for required in metas[dsl_file]["requires"]:
+            if required not in metas:
+                raise ValueError(f"{dsl_file.relative_to(TESTS_DIR)} requires unknown scenario "
+                                 f"{required.relative_to(TESTS_DIR)}")
+            if required in selected:
+                visit(required)
+        visiting.discard(dsl_file)
+        ordered.append(dsl_file)
+
+    for dsl_file in dsl_files:
+        visit(dsl_file)
+    return ordered
+
+def plan_batches(dsl_files, metas):
+    """
+    Ordered scenarios as batches of one: every scenario writes to the fixtures
+    (if only through the server), so none can share a restored state.
+    """
+    return [[dsl_file] for dsl_file in order_scenarios(dsl_files, metas)]
+
+def indices_to_reset(slot, batch, metas):
+    """
+    What has to be reset on `slot` before running `batch`: None (nothing),
+    ALL_INDICES, or a sorted list of the dirty indices the batch touches.
+    """
+    touched = set()
+    for dsl_file in batch:
+        touched |= metas[dsl_file]["reads"] | metas[dsl_file]["mutates"]
+    if not touched or not slot.dirty:
+        return None
+    if ALL_INDICES in slot.dirty:
+        return ALL_INDICES
+    needed = slot.dirty if ALL_INDICES in touched else slot.dirty & touched
+    return sorted(needed) or None
+
+def mark_reset(slot, indices):
+    """Record that `indices` (or everything) were just restored on `slot`."""
+    slot.dirty = set() if indices == ALL_INDICES else slot.dirty - set(indices)
+
+def mark_mutated(slot, batch, metas=None):
+    """Record the indices `batch` may have changed on `slot`."""
+    if metas is None:
+        slot.dirty = {ALL_INDICES}
+        return
+    for dsl_file in batch:
+        mutates = metas[dsl_file]["mutates"]
+        slot.dirty = {ALL_INDICES} if ALL_INDICES in mutates else slot.dirty | mutates
+
+def print_timing_summary(suite_time):
+    """Print where the suite time went, aggregated per span name."""
+    if not TIMINGS_FILE.exists():
+        return
+    phases = {}
+    scenarios = {}
+    with open(TIMINGS_FILE) as f:
+        for line in f:
+            record = json.loads(line)
+            phases.setdefault(record["span"], []).append(record["duration"])
+            # Top-level phases only (nested spans contain a dot)
+            if record["scenario"] and "." not in record["span"]:
+                scenarios[record["scenario"]] = scenarios.get(record["scenario"], 0) + record["duration"]
+    if not phases:
+        return
+
+    log(f"Phase timings (suite wall time {suite_time:.2f}s, spans in {TIMINGS_FILE.name}):", level="INFO")
+    print(f"  {'PHASE':<16} {'COUNT':>6} {'TOTAL':>9} {'AVG':>8} {'MAX':>8} {'SHARE':>6}")
+    for name, durations in sorted(phases.items(), key=lambda item: -sum(item[1])):
+        total = sum(durations)
+        share = total / suite_time * 100 if suite_time else 0
+        print(f"  {name:<16} {len(durations):>6} {total:>8.2f}s {total / len(durations):>7.2f}s "
+              f"{max(durations):>7.2f}s {share:>5.1f}%")
+    if scenarios:
+        log("Slowest scenarios:", level="INFO")
+        for name, total in sorted(scenarios.items(), key=lambda item: -item[1])[:5]:
+            print(f"  {total:8.2f}s  {name}")
 
 # ================= CORE LOGIC =================
 
-def run_single_dsl_test(dsl_file, loadgen_bin):
+# The shared Easysearch client and the snapshot format live next to the import script
+sys.path.insert(0, str(SNAPSHOT_SCRIPT.parent))
+
+_es_client = None
+_es_client_lock = threading.Lock()
+
+def es_client():
+    """
+    Shared Easysearch client (tests/snapshot/es_client.py), created on first use.
+    Its keep-alive connections are reused by every slot.
+    """
+    global _es_client
+    with _es_client_lock:
+        if _es_client is None:
+            from es_client import EsClient
+            _es_client = EsClient(ES_ENDPOINT, ES_USERNAME, ES_PASSWORD,
+                                  max_connections=max(TEST_WORKERS, 1) * VERIFY_WORKERS, timeout=30)
+        return _es_client
+
+def es_json(method, path, body=None):
+    """JSON request through the shared client; raises RuntimeError on HTTP errors."""
+    status, data = es_client().call(method, path, body)
+    if status >= 400:
+        raise RuntimeError(f"{method} {path} returned HTTP {status}: {data[:200].decode('utf-8', errors='replace')}")
+    return json.loads(data)
+
+def doc_digests(sources):
+    """
+    {document key: digest} of (source, fallback key) pairs. Documents without
+    a key are keyed by their digest, so they still diff by content.
+    """
+    import snapshot_format
+    digests = {}
+    for source, fallback in sources:
+        digest = snapshot_format.source_digest(source)
+        digests[snapshot_format.doc_key(source, fallback) or digest.hex()] = digest
+    return digests
+
+_expected_digests = {}
+_expected_lock = threading.Lock()
+
+def expected_digests(name, entry):
+    """Document digests of an exported index, computed once per run (fixtures don't change)."""
+    import snapshot_format
+    key = (name, snapshot_format.entry_fingerprint(entry))
+    with _expected_lock:
+        if key not in _expected_digests:
+            idx_dir = os.path.join(SNAPSHOT_SCRIPT.parent / "repo", name)
+            _expected_digests[key] = doc_digests(
+                (json.loads(line), None) for line in snapshot_format.iter_data_lines(idx_dir, entry))
+        return _expected_digests[key]
+
+def live_digests(index):
+    """Document digests of a live index, read with a scroll in index order."""
+    def sources():
+        res = es_json("POST", f"{index}/_search?scroll=1m", {"size": 1000, "sort": ["_doc"]})
+        scroll_id = res.get("_scroll_id")
+        try:
+            hits = res["hits"]["hits"]
+            while hits:
+                for hit in hits:
+                    yield hit.get("_source", {}), None
+                res = es_json("POST", "_search/scroll", {"scroll": "1m", "scroll_id": scroll_id})
+                scroll_id = res.get("_scroll_id", scroll_id)
+                hits = res["hits"]["hits"]
+        finally:
+            if scroll_id:
+                es_client().call("DELETE", "_search/scroll", {"scroll_id": scroll_id})
+    return doc_digests(sources())
+
+def describe_diff(index, expected, live):
+    """One line naming the documents that are missing, unexpected or changed."""
+    missing = sorted(set(expected) - set(live))
+    extra = sorted(set(live) - set(expected))
+    changed = sorted(key for key in set(expected) & set(live) if expected[key] != live[key])
+    parts = [f"{label} {len(keys)} {keys[:VERIFY_DIFF_KEYS]}"
+             for label, keys in (("missing", missing), ("unexpected", extra), ("changed", changed)) if keys]
+    return f"{index}: " + ", ".join(parts)
+
+def verify_index(slot, name, entry):
+    """Compare one restored index with its manifest entry. Returns a problem description or None."""
+    index = slot.index_prefix + name[len(DEFAULT_INDEX_PREFIX):] if name.startswith(DEFAULT_INDEX_PREFIX) else name
+    status, data = es_client().call("GET", f"{index}/_count")
+    if status == 404:
+        return f"{index}: index missing"
+    if status >= 400:
+        return f"{index}: _count returned HTTP {status}"
+    count = json.loads(data)["count"]
+    if count == entry["docs"] and VERIFY_MODE != "checksum":
+        return None
+
+    import snapshot_format
+    expected = expected_digests(name, entry)
+    live = live_digests(index)
+    if count != entry["docs"]:
+        return f"{describe_diff(index, expected, live)} ({count} docs, manifest has {entry['docs']})"
+    if snapshot_format.content_hash(live.values()) != snapshot_format.content_hash(expected.values()):
+        return describe_diff(index, expected, live)
+    return None
+
+def verify_restore(slot=DEFAULT_SLOT):
     """
-    Execute lifecycle: Stop -> Restore -> Start -> Run -> Stop
+    Check the slot's pristine indices against the snapshot manifest (see VERIFY_MODE)
+    and raise RuntimeError with a per-index diff if the restore is incomplete.
     """
+    if VERIFY_MODE == "off":
+        log("Restore verification disabled (VERIFY_MODE=off).", level="DEBUG")
+        return
+    import snapshot_format
+    indices = snapshot_format.list_indices(str(SNAPSHOT_SCRIPT.parent / "repo"))
+    if ALL_INDICES in slot.dirty:
+        return
+    pristine = {name: entry for name, entry in indices.items() if name not in slot.dirty and "docs" in entry}
+    if not pristine:
+        log("No manifest doc counts to verify against (legacy snapshot repo).", level="WARN")
+        return
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=VERIFY_WORKERS) as pool:
+        problems = [p for p in pool.map(lambda item: verify_index(slot, *item), pristine.items()) if p]
+    if problems:
+        for problem in problems:
+            log(problem, level="ERROR")
+        raise RuntimeError("Restore verification failed:\n" + "\n".join(problems))
+    log(f"Verified {len(pristine)} indices ({VERIFY_MODE}) in {(time.time() - start) * 1000:.0f}ms.", level="SUCCESS")
+
+def log_tail(text):
+    """Last REPORT_LOG_LINES lines of a command's output."""
+    return "\n".join((text or "").splitlines()[-REPORT_LOG_LINES:])
+
+def run_loadgen(dsl_file, loadgen_bin, slot=DEFAULT_SLOT):
+    """Run one scenario with loadgen against the slot's server. Returns a ScenarioResult."""
+    _log_context.tag = f"[{slot.name}]" if slot is not DEFAULT_SLOT else ""
+    _log_context.scenario = str(dsl_file.relative_to(TESTS_DIR))
     dsl_path = str(Path(dsl_file).absolute())
-    log(f"Lifecycle START for: {dsl_file.name}", level="HEADER")
+    config_path = TESTS_DIR / "loadgen.yml"
+    cmd = f"{loadgen_bin} -config {config_path} -run {dsl_path} -debug"
+    env = None
+    if slot is not DEFAULT_SLOT:
+        env = dict(os.environ,
+                   COCO_SERVER=slot.coco_server,
+                   DATASOURCE_INDEX=f"{slot.index_prefix}datasource-v2")
+    name = str(dsl_file.relative_to(TESTS_DIR))
+    start = time.time()
+    try:
+        with span("loadgen", slot):
+            run_cmd(cmd, check=True, slot=slot, env=env, capture=True)
+    except subprocess.CalledProcessError as e:
+        log(f"Test FAILED: {dsl_file.name}", level="ERROR")
+        output = log_tail(e.output)
+        server_log = log_excerpt(slot.log_file, slot, max_lines=REPORT_LOG_LINES)
+        if server_log:
+            output += f"\n--- Coco Server log ({slot.log_file.name}) ---\n{server_log}"
+        return ScenarioResult(name, "failed", time.time() - start, output)
+    log(f"Test PASSED: {dsl_file.name}", level="SUCCESS")
+    return ScenarioResult(name, "passed", time.time() - start)
+
+def run_batch(batch, loadgen_bin, slot=DEFAULT_SLOT, reset=ALL_INDICES, metas=None):
+    """
+    Execute lifecycle: Stop -> Restore -> Start -> Run (each scenario) -> Stop
+    (with PERSISTENT_SERVER: Restore -> Reuse/Restart -> Run)
+    `reset` is what to restore first (see indices_to_reset); scenarios of a
+    batch share that state and one server start. Without `metas` the batch is
+    assumed to mutate every index.
+    Returns {dsl_file: ScenarioResult}.
+    """
+    names = ", ".join(dsl_file.name for dsl_file in batch)
+    _log_context.scenario = " + ".join(str(dsl_file.relative_to(TESTS_DIR)) for dsl_file in batch)
+    log(f"Lifecycle START for: {names}", level="HEADER")
+    start = time.time()
+    # Until loadgen reports, a scenario counts as failed in environment setup
+    results = {dsl_file: ScenarioResult(str(dsl_file.relative_to(TESTS_DIR)), "failed") for dsl_file in batch}
+
+    def setup_failed(message):
+        for result in results.values():
+            result.duration = time.time() - start
+            result.log = message
 
     try:
         # 1. Cleanup Environment
         log("1. Cleaning up previous environment...", level="STEP")
-        stop_coco_server()
+        if not PERSISTENT_SERVER:
+            with span("stop", slot):
+                stop_coco_server(slot)
 
         # 2. Restore Data
-        log("2. Restoring Easysearch data...", level="STEP")
-        run_cmd(f"python3 {SNAPSHOT_SCRIPT}", check=True)
+        if reset is None:
+            log("2. Restoring Easysearch data... (skipped, touched indices are pristine)", level="STEP")
+        else:
+            target = "all indices" if reset == ALL_INDICES else ", ".join(reset)
+            log(f"2. Restoring Easysearch data ({target})...", level="STEP")
+            with span("restore", slot, mode=RESET_MODE, indices=reset):
+                mark_reset(slot, reset_data(slot, reset))
 
         # 3. Check if restore was successful
         log("3. Verifying data restore...", level="STEP")
-        
-        # Calculate Basic Auth in Python
-        user_pass = f"{ES_USERNAME}:{ES_PASSWORD}"
-        b64_auth = base64.b64encode(user_pass.encode('utf-8')).decode('utf-8')
-
-        # Wait a few seconds for ES to stabilize
-        time.sleep(2)
-
-        # Construct curl command
-        # -k: Insecure (ignore self-signed certs)
-        # -s: Silent
-        # ES_ENDPOINT usually contains https://, so don't double append
-        verify_cmd = f"curl -k -s -X GET -H 'Authorization: Basic {b64_auth}' {ES_ENDPOINT}/_cat/indices?v&h=i,h,s,dc"
-        
-        run_cmd(verify_cmd, check=True)
+        # The import script ends with a refresh + shard readiness barrier,
+        # so the restored indices can be inspected right away
+        with span("verify", slot):
+            verify_restore(slot)
 
         # 4. Start Service
         log("4. Starting Coco Server...", level="STEP")
-        start_coco_server()
+        with span("start", slot, persistent=PERSISTENT_SERVER):
+            if PERSISTENT_SERVER:
+                ensure_coco_server(slot, data_reset=reset is not None)
+            else:
+                start_coco_server(slot)
 
         # 5. Run Test (Loadgen)
         log("5. Running Loadgen test...", level="STEP")
-        config_path = TESTS_DIR / "loadgen.yml"
-        cmd = f"{loadgen_bin} -config {config_path} -run {dsl_path} -debug"
-        run_cmd(cmd, check=True)
-
-        log(f"Test PASSED: {dsl_file.name}", level="SUCCESS")
+        mark_logs(slot)
+        for dsl_file in batch:
+            results[dsl_file] = run_loadgen(dsl_file, loadgen_bin, slot)
 
-    except subprocess.CalledProcessError:
-        log(f"Test FAILED: {dsl_file.name}", level="ERROR")
-        sys.exit(1)
+    except subprocess.CalledProcessError as e:
+        log(f"Test FAILED: {names}", level="ERROR")
+        setup_failed(f"Environment setup failed: [{e.cmd}] exited with {e.returncode}\n{log_tail(e.output)}")
     except Exception as e:
         log(f"Unexpected Exception: {e}", level="ERROR")
-        sys.exit(1)
+        setup_failed(f"Environment setup failed: {e}")
     finally:
+        _log_context.scenario = " + ".join(str(dsl_file.relative_to(TESTS_DIR)) for dsl_file in batch)
         # 6. Final Cleanup
         log("6. Final cleanup...", level="STEP")
-        stop_coco_server()
+        if not PERSISTENT_SERVER:
+            with span("cleanup", slot):
+                stop_coco_server(slot)
+        _log_context.scenario = ""
+        mark_mutated(slot, batch, metas)
+    return results
+
+def run_single_dsl_test(dsl_file, loadgen_bin, slot=DEFAULT_SLOT):
+    """
+    Run one scenario after a full reset. Returns True if the scenario passed.
+    """
+    return run_batch([dsl_file], loadgen_bin, slot)[dsl_file].passed
+
+def run_scheduled(batches, metas, loadgen_bin, slots, fail_fast=False):
+    """
+    Run scenario batches on a pool of worker slots. Each worker borrows a free
+    slot for one batch at a time and only resets what the batch needs on that
+    slot. A batch whose required scenarios did not pass is skipped, as is
+    everything not yet started once a scenario failed with fail_fast.
+    Requirements outside of `batches` are taken as already satisfied.
+    Returns {dsl_file: ScenarioResult}.
+    """
+    free_slots = Queue()
+    for slot in slots:
+        free_slots.put(slot)
+    done = {dsl_file: threading.Event() for batch in batches for dsl_file in batch}
+    results = {}
+    stop = threading.Event()
+
+    def worker(batch):
+        # Requirements were scheduled earlier, so waiting here cannot deadlock
+        required = [r for dsl_file in batch for r in metas[dsl_file]["requires"]
+                    if r not in batch and r in done]
+        for r in required:
+            done[r].wait()
+        if stop.is_set() or any(not results[r].passed for r in required):
+            for dsl_file in batch:
+                name = str(dsl_file.relative_to(TESTS_DIR))
+                reason = "fail-fast" if stop.is_set() else "a required scenario did not pass"
+                log(f"Skipping {name} ({reason})", level="WARN")
+                results[dsl_file] = ScenarioResult(name, "skipped", log=reason)
+                done[dsl_file].set()
+            return
+
+        slot = free_slots.get()
+        if slot is not DEFAULT_SLOT:
+            _log_context.tag = f"[{slot.name}]"
+        try:
+            for dsl_file in batch:
+                log(f"SCENARIO: {dsl_file.relative_to(TESTS_DIR)}", level="START")
+            reset = indices_to_reset(slot, batch, metas)
+            outcome = run_batch(batch, loadgen_bin, slot, reset, metas)
+            results.update(outcome)
+            if fail_fast and not all(result.passed for result in outcome.values()):
+                stop.set()
+        finally:
+            _log_context.tag = ""
+            free_slots.put(slot)
+            for dsl_file in batch:
+                done[dsl_file].set()
+
+    with ThreadPoolExecutor(max_workers=len(slots)) as pool:
+        list(pool.map(worker, batches))
+    return {dsl_file: results[dsl_file] for batch in batches for dsl_file in batch}
+
+def print_results(results):
+    """Print the combined pass/fail report."""
+    log("Scenario results:", level="INFO")
+    for result in results.values():
+        print(f"  {result.status.upper():<7} {result.duration:7.2f}s  {result.name}")
+
+def load_report(report_dir=REPORT_DIR):
+    """Results of the previous run as {name: result dict}, or {} if there is none."""
+    path = report_dir / REPORT_JSON
+    if not path.exists():
+        return {}
+    return {entry["name"]: entry for entry in json.loads(path.read_text())["scenarios"]}
+
+def write_reports(results, previous=None, report_dir=REPORT_DIR):
+    """
+    Write the JSON and JUnit XML reports. Scenarios from `previous` that were
+    not run this time (--rerun-failed) keep their earlier result.
+    """
+    entries = dict(previous or {})
+    for result in results.values():
+        entries[result.name] = {
+            "name": result.name,
+            "status": result.status,
+            "duration": round(result.duration, 3),
+            "log": result.log,
+        }
+    ordered = [entries[name] for name in sorted(entries)]
+    counts = {status: sum(e["status"] == status for e in ordered) for status in ("passed", "failed", "skipped")}
+
+    report_dir.mkdir(parents=True, exist_ok=True)
+    (report_dir / REPORT_JSON).write_text(json.dumps({
+        "summary": dict(counts, total=len(ordered)),
+        "scenarios": ordered,
+    }, indent=2) + "\n")
+
+    suite = ElementTree.Element("testsuite", {
+        "name": "coco-integration",
+        "tests": str(len(ordered)),
+        "failures": str(counts["failed"]),
+        "skipped": str(counts["skipped"]),
+        "time": f"{sum(e['duration'] for e in ordered):.3f}",
+    })
+    for entry in ordered:
+        classname, _, name = entry["name"].rpartition("/")
+        case = ElementTree.SubElement(suite, "testcase", {
+            "classname": classname.replace("/", ".") or "tests",
+            "name": name,
+            "time": f"{entry['duration']:.3f}",
+        })
+        if entry["status"] == "failed":
+            failure = ElementTree.SubElement(case, "failure", {"message": f"{entry['name']} failed"})
+            failure.text = entry["log"]
+        elif entry["status"] == "skipped":
+            ElementTree.SubElement(case, "skipped", {"message": entry["log"]})
+    ElementTree.ElementTree(suite).write(report_dir / REPORT_JUNIT, encoding="utf-8", xml_declaration=True)
+    log(f"Reports written: {report_dir / REPORT_JSON}, {report_dir / REPORT_JUNIT}", level="INFO")
 
 def main():
+    parser = argparse.ArgumentParser(description="Run the Coco integration test scenarios")
+    parser.add_argument("--fail-fast", action="store_true", default=FAIL_FAST,
+                        help="Stop starting new scenarios after the first failure (env FAIL_FAST)")
+    parser.add_argument("--rerun-failed", action="store_true",
+                        help=f"Only run scenarios that failed or were skipped in the previous {REPORT_JSON}")
+    args = parser.parse_args()
+
     check_project_root()
     loadgen_bin = resolve_loadgen()
     log(f"Using loadgen binary: {loadgen_bin}", level="INFO")
@@ -266,14 +1201,52 @@ def main():
         log("No .dsl files found under tests/.", level="WARN")
         return
 
-    log(f"Found {len(dsl_files)} DSL scenarios to run.", level="INFO")
+    metas = load_scenario_meta(dsl_files)
 
-    for i, dsl_file in enumerate(dsl_files, start=1):
-        print("\n" + "="*80)
-        log(f"SCENARIO [{i}/{len(dsl_files)}]: {dsl_file.name}", level="START")
-        print("="*80 + "\n")
-        
-        run_single_dsl_test(dsl_file, loadgen_bin)
+    previous = {}
+    if args.rerun_failed:
+        previous = load_report()
+        if not previous:
+            log(f"No previous {REPORT_JSON} in {REPORT_DIR}; running everything.", level="WARN")
+        else:
+            rerun = {name for name, entry in previous.items() if entry["status"] != "passed"}
+            dsl_files = [f for f in dsl_files if str(f.relative_to(TESTS_DIR)) in rerun]
+            if not dsl_files:
+                log("Nothing to rerun: every scenario passed last time.", level="SUCCESS")
+                return
+
+    log(f"Found {len(dsl_files)} DSL scenarios to run (reset mode: {RESET_MODE}, persistent server: {PERSISTENT_SERVER}, "
+        f"fail-fast: {args.fail_fast}).", level="INFO")
+
+    if PERSISTENT_SERVER and not (COCO_CACHE_RESET_URL or COCO_CACHE_RESET_SIGNAL):
+        log("Persistent server without COCO_CACHE_RESET_URL / COCO_CACHE_RESET_SIGNAL: "
+            "Coco Server is restarted after every data reset.", level="WARN")
+
+    batches = plan_batches(dsl_files, metas)
+    log(f"Scheduled {len(dsl_files)} scenarios in {len(batches)} batch(es).", level="INFO")
+
+    slots = create_slots(TEST_WORKERS)
+    TIMINGS_FILE.write_text("")
+    suite_start = time.time()
+
+    try:
+        if len(slots) > 1:
+            log(f"Running scenarios in parallel on {len(slots)} worker slots.", level="INFO")
+        results = run_scheduled(batches, metas, loadgen_bin, slots, fail_fast=args.fail_fast)
+        print_results(results)
+        write_reports(results, previous)
+        failed = [r for r in results.values() if r.status == "failed"]
+        skipped = [r for r in results.values() if r.status == "skipped"]
+        if failed or skipped:
+            log(f"{len(failed)} of {len(dsl_files)} tests failed, {len(skipped)} skipped. "
+                f"Rerun them with --rerun-failed.", level="ERROR")
+            sys.exit(1)
+    finally:
+        if PERSISTENT_SERVER:
+            for slot in slots:
+                with span("cleanup", slot):
+                    stop_coco_server(slot)
+        print_timing_summary(time.time() - suite_start)
 
     print("\n" + "="*80)
     log(f"All {len(dsl_files)} tests passed successfully!", level="SUCCESS")
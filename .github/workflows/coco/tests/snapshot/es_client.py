@@ -0,0 +1,273 @@
+"""
+Easysearch HTTP client shared by export_data_raw.py, import_data_raw.py and
+run_integration_tests.py.
+
+One client keeps a pool of persistent (keep-alive) connections, so a run pays
+one TLS handshake per connection instead of one per request. It is safe to use
+from many threads: at most `max_connections` requests are in flight at once,
+and callers beyond that wait for a free connection.
+
+A request that could not be sent (connection refused or dropped while
+sending) is retried with exponential backoff and jitter. Once it was sent,
+only idempotent requests are retried, after a lost response or a
+502/503/504: a _bulk without document IDs that the node applied but whose
+response got lost would otherwise be indexed twice. With compression on,
+request bodies are gzip-compressed on the fly (sent chunked) and gzip
+responses are accepted and decoded while they are read.
+"""
+
+import re
+import ssl
+import gzip
+import zlib
+import time
+import json
+import base64
+import codecs
+import random
+import select
+import threading
+import http.client
+from contextlib import contextmanager
+from queue import LifoQueue, Empty
+from urllib.parse import urlsplit
+
+# Responses worth retrying: the node (or a proxy in front of it) is not ready
+RETRY_STATUSES = (502, 503, 504)
+# Requests that can safely be sent again after they may have been applied:
+# idempotent methods, and POSTs to read-only endpoints
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE")
+READ_ONLY_ENDPOINTS = ("_search", "scroll", "_count", "_mget", "_msearch", "_refresh")
+# gzip level for request bodies: cheap to produce, most of the size win on JSON
+COMPRESS_LEVEL = 3
+# Uncompressed bytes fed to the compressor / read from a response at a time
+CHUNK_SIZE = 256 * 1024
+
+def gzip_chunks(body, chunk_size=CHUNK_SIZE):
+    """
+    Compress `body` in pieces, yielding gzip output as it is produced, so the
+    request can be sent (chunked) without a compressed copy of the whole body.
+    """
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)
+    view = memoryview(body)
+    for start in range(0, len(view), chunk_size):
+        out = compressor.compress(view[start:start + chunk_size])
+        if out:
+            yield out
+    yield compressor.flush()
+
+_BULK_ERRORS = re.compile(r'"errors"\s*:\s*(true|false)')
+_BULK_ITEMS = re.compile(r'"items"\s*:\s*\[')
+
+def read_bulk_response(stream, chunk_size=CHUNK_SIZE):
+    """
+    Parse a _bulk response while it is read, keeping only the failed items.
+    Returns a list of (position, result) for every item with status >= 300,
+    where result is the item's action object ({"status": ..., "error": ...}).
+    When the response reports `"errors": false` the items are not parsed at all.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    buf, eof = "", False
+
+    def fill():
+        nonlocal buf, eof
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buf += text.decode(chunk or b"", final=eof)
+
+    # Header fields (took, errors, ...) come before the items array
+    while True:
+        items = _BULK_ITEMS.search(buf)
+        errors = _BULK_ERRORS.search(buf, 0, items.start() if items else len(buf))
+        if errors and errors.group(1) == "false":
+            while stream.read(chunk_size):
+                pass
+            return []
+        if items:
+            break
+        if eof:
+            raise ValueError("malformed _bulk response: no items")
+        fill()
+
+    failed, position, pos = [], 0, items.end()
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+        if pos < len(buf) and buf[pos] == "]":
+            break
+        try:
+            item, pos = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # Item cut off at the chunk boundary: drop what is parsed, read more
+            buf, pos = buf[pos:], 0
+            fill()
+            continue
+        result = next(iter(item.values()), {})
+        if result.get("status", 200) >= 300:
+            failed.append((position, result))
+        position += 1
+    # Drain the rest so the connection can be reused
+    while stream.read(chunk_size):
+        pass
+    return failed
+
+class EsClient:
+    def __init__(self, endpoint, username, password, max_connections=16,
+                 timeout=120, retries=3, backoff_base=0.1, backoff_max=5.0,
+                 compress=False):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.compress = compress
+
+        url = urlsplit(endpoint)
+        self._scheme = url.scheme
+        self._host = url.hostname
+        self._port = url.port or (443 if url.scheme == "https" else 80)
+        self._base_path = url.path.rstrip("/")
+
+        # Self-signed certificates are the norm on test clusters
+        self._ctx = ssl.create_default_context()
+        self._ctx.check_hostname = False
+        self._ctx.verify_mode = ssl.CERT_NONE
+
+        auth = base64.b64encode(f"{username}:{password}".encode("utf-8")).decode("ascii")
+        self.headers = {
+            "Authorization": f"Basic {auth}",
+            "Content-Type": "application/json",
+        }
+
+        self._connections = LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_connections)
+
+    def _new_connection(self):
+        if self._scheme == "https":
+            return http.client.HTTPSConnection(self._host, self._port, context=self._ctx, timeout=self.timeout)
+        return http.client.HTTPConnection(self._host, self._port, timeout=self.timeout)
+
+    @staticmethod
+    def _dropped(conn):
+        """
+        True if the node closed an idle pooled connection: its socket reads as
+        ready (EOF) with no request outstanding. Checked before reuse, so a
+        request that must not be resent does not go out on a dead connection.
+        """
+        if conn.sock is None:
+            return False
+        try:
+            return bool(select.select([conn.sock], [], [], 0)[0])
+        except (OSError, ValueError):
+            return True
+
+    def _backoff(self, attempt):
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        time.sleep(delay / 2 + random.uniform(0, delay / 2))
+
+    def _release(self, conn, response):
+        """Finish reading a response and return its connection to the pool."""
+        response.read()
+        if response.will_close:
+            conn.close()
+        else:
+            self._connections.put(conn)
+
+    @staticmethod
+    def idempotent(method, path):
+        """True if sending the request twice has the same effect as sending it once."""
+        endpoint = path.split("?", 1)[0].rstrip("/").rsplit("/", 1)[-1]
+        return method.upper() in IDEMPOTENT_METHODS or endpoint in READ_ONLY_ENDPOINTS
+
+    @contextmanager
+    def open(self, method, path, body=None, headers=None, compress=None, retries=None):
+        """
+        Send a request and yield (status, stream): the response body as a
+        file-like object, gzip-decoded while read. The connection goes back to
+        the pool when the block exits. `body` is bytes, or any other value to
+        be sent as JSON. Raises the last connection error once the retries are
+        used up, or at once for a non-idempotent request whose response was
+        lost after it was sent (retries stop once a response has been yielded).
+        """
+        retries = self.retries if retries is None else retries
+        resend = self.idempotent(method, path)
+        compress = self.compress if compress is None else compress
+        if body is not None and not isinstance(body, (bytes, bytearray)):
+            body = json.dumps(body).encode("utf-8")
+        headers = dict(self.headers, **(headers or {}))
+        if compress:
+            headers["Accept-Encoding"] = "gzip"
+            if body:
+                headers["Content-Encoding"] = "gzip"
+        path = f"{self._base_path}/{path.lstrip('/')}"
+
+        for attempt in range(retries + 1):
+            if attempt > 1:
+                # The first retry is immediate: a stale keep-alive connection fails on first use
+                self._backoff(attempt - 1)
+            with self._slots:
+                try:
+                    conn = self._connections.get_nowait()
+                    if self._dropped(conn):
+                        conn.close()
+                        conn = self._new_connection()
+                except Empty:
+                    conn = self._new_connection()
+                try:
+                    conn.request(method, path, body=gzip_chunks(body) if compress and body else body,
+                                 headers=headers)
+                except (http.client.HTTPException, OSError):
+                    # Not (completely) sent: safe to send again whatever the method
+                    conn.close()
+                    if attempt >= retries:
+                        raise
+                    continue
+                try:
+                    response = conn.getresponse()
+                except (http.client.HTTPException, OSError):
+                    # Sent, but the node may have applied it before the response was lost
+                    conn.close()
+                    if attempt >= retries or not resend:
+                        raise
+                    continue
+                if response.status in RETRY_STATUSES and resend and attempt < retries:
+                    self._release(conn, response)
+                    continue
+                stream = response
+                if response.getheader("Content-Encoding") == "gzip":
+                    stream = gzip.GzipFile(fileobj=response)
+                try:
+                    yield response.status, stream
+                except BaseException:
+                    conn.close()
+                    raise
+                self._release(conn, response)
+                return
+
+    def call(self, method, path, body=None, headers=None, compress=None, retries=None):
+        """
+        Send a request and return (status, response body bytes). See open().
+        """
+        with self.open(method, path, body, headers, compress, retries) as (status, stream):
+            return status, stream.read()
+
+    def request(self, method, path, body=None):
+        """
+        JSON request. Returns the decoded response, or {"error": status, "msg": text}
+        for HTTP errors (the caller decides whether e.g. a 404 is fine).
+        """
+        status, data = self.call(method, path, body)
+        if status >= 400:
+            return {"error": status, "msg": data.decode("utf-8", errors="replace")}
+        return json.loads(data.decode("utf-8")) if data else {}
+
+    def close(self):
+        """Close all idle pooled connections."""
+        while True:
+            try:
+                self._connections.get_nowait().close()
+            except Empty:
+                return
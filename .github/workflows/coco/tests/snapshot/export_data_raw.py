@@ -1,9 +1,12 @@
 import os
 import json
-import ssl
-import base64
-import urllib.request
-import urllib.error
+import glob
+import heapq
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import snapshot_format
+from es_client import EsClient
 
 # ================= CONFIGURATION =================
 # Easysearch Host (HTTPS)
@@ -15,40 +18,38 @@ ES_PASSWORD = os.getenv("ES_PASSWORD", "changeme")
 INDEX_PATTERN = "coco*"
 # Output Directory
 OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "repo")
+# Number of indices exported in parallel
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "4"))
+# Max sliced-scroll slices per index (small indices use fewer)
+EXPORT_SLICES = int(os.getenv("EXPORT_SLICES", "4"))
+# Documents per scroll page
+SCROLL_SIZE = 1000
+# Documents per sorted temp run (bounds memory while ordering the output)
+SORT_RUN_SIZE = 50000
+# Data file compression: none | gzip | zstd (zstd needs the 'zstandard' package)
+SNAPSHOT_COMPRESSION = os.getenv("SNAPSHOT_COMPRESSION", "none")
+# Date field tracking document changes; indices without it are always exported in full
+HWM_FIELD = os.getenv("SNAPSHOT_HWM_FIELD", "updated")
 # =============================================
 
-# 1. Setup SSL Context (Ignore self-signed certificate errors)
-ctx = ssl.create_default_context()
-ctx.check_hostname = False
-ctx.verify_mode = ssl.CERT_NONE
-
-# 2. Setup Basic Auth Headers
-auth_str = f"{ES_USERNAME}:{ES_PASSWORD}"
-auth_bytes = auth_str.encode("ascii")
-base64_auth = base64.b64encode(auth_bytes).decode("ascii")
-HEADERS = {
-    "Authorization": f"Basic {base64_auth}",
-    "Content-Type": "application/json"
-}
+# Shared keep-alive connection pool: every export worker and scroll slice
+# reuses the same connections instead of opening one per request
+es = EsClient(ES_ENDPOINT, ES_USERNAME, ES_PASSWORD,
+              max_connections=EXPORT_WORKERS * EXPORT_SLICES)
 
 def es_request(method, endpoint, body=None):
     """
-    Helper function to make HTTP requests to Easysearch using standard library.
+    Helper function to make HTTP requests to Easysearch. Returns None on errors.
     """
-    url = f"{ES_ENDPOINT}/{endpoint.lstrip('/')}"
-    data = json.dumps(body).encode("utf-8") if body else None
-    
-    req = urllib.request.Request(url, data=data, headers=HEADERS, method=method)
-    
     try:
-        with urllib.request.urlopen(req, context=ctx) as response:
-            return json.loads(response.read().decode("utf-8"))
-    except urllib.error.HTTPError as e:
-        print(f"   [HTTP Error] {e.code}: {e.read().decode('utf-8')}")
-        return None
+        status, data = es.call(method, endpoint, body)
     except Exception as e:
         print(f"   [Error] {e}")
         return None
+    if status >= 400:
+        print(f"   [HTTP Error] {status}: {data.decode('utf-8', errors='replace')}")
+        return None
+    return json.loads(data.decode("utf-8"))
 
 def clean_settings(settings_dict):
     """
@@ -67,7 +68,355 @@ def clean_settings(settings_dict):
     
     return settings_dict
 
+def export_schema(idx, idx_dir):
+    """
+    Save portable settings and mappings of an index next to schema.json, to
+    a temp file that commit_schema() moves into place once the data is
+    exported. Returns the temp path, or None if the index could not be read.
+    """
+    meta = es_request("GET", idx)
+    if meta and idx in meta:
+        original_settings = meta[idx].get("settings", {})
+        mappings = meta[idx].get("mappings", {})
+        
+        # Clean settings
+        cleaned_settings = clean_settings(original_settings)
+
+        # Drop the restore markers written by import_data_raw.py
+        meta_fields = mappings.get("_meta", {})
+        for key in ("snapshot_sha256", "schema_sha256"):
+            meta_fields.pop(key, None)
+        if "_meta" in mappings and not meta_fields:
+            del mappings["_meta"]
+        
+        # Build Schema Structure
+        schema = {
+            "settings": cleaned_settings,
+            "mappings": mappings
+        }
+        
+        path = os.path.join(idx_dir, f".{snapshot_format.SCHEMA_FILE}.tmp")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(schema, f, ensure_ascii=False, indent=2)
+        return path
+    return None
+
+def commit_schema(idx, schema_path):
+    """
+    Replace schema.json with the schema read by export_schema(); only done
+    after the data (base or delta layer) is written, so a failed export
+    leaves the previous schema next to the previous data.
+    """
+    os.replace(schema_path, os.path.join(os.path.dirname(schema_path), snapshot_format.SCHEMA_FILE))
+    print(f"   ✅ [{idx}] Schema saved.")
+
+def write_run(idx_dir, slice_id, run_id, rows):
+    """
+    Write one sorted temp run of (sort_key, source_line) rows.
+    """
+    rows.sort()
+    path = os.path.join(idx_dir, f".slice-{slice_id}-{run_id}.tmp")
+    with open(path, "w", encoding="utf-8") as f:
+        for key, line in rows:
+            f.write(f"{key}\t{line}\n")
+    return path
+
+def export_slice(idx, idx_dir, slice_id, max_slices):
+    """
+    Read one slice of an index with a sliced scroll and write it as sorted temp runs.
+    Returns (doc_count, run_paths); doc_count is None if the scroll failed.
+    """
+    body = {
+        "size": SCROLL_SIZE,
+        "query": {"match_all": {}},
+        "sort": ["_doc"]
+    }
+    if max_slices > 1:
+        body["slice"] = {"id": slice_id, "max": max_slices}
+
+    res = es_request("POST", f"{idx}/_search?scroll=1m", body)
+    if not res:
+        return None, []
+
+    scroll_id = res.get("_scroll_id")
+    hits = res.get("hits", {}).get("hits", [])
+    total_docs = 0
+    rows, runs = [], []
+
+    while hits:
+        for doc in hits:
+            # Sort key: JSON-encoded _id (never contains a tab or newline)
+            rows.append((json.dumps(doc["_id"]), json.dumps(doc["_source"], ensure_ascii=False)))
+            total_docs += 1
+        if len(rows) >= SORT_RUN_SIZE:
+            runs.append(write_run(idx_dir, slice_id, len(runs), rows))
+            rows = []
+
+        # Fetch next batch
+        res = es_request("POST", "_search/scroll", {
+            "scroll": "1m",
+            "scroll_id": scroll_id
+        })
+        if not res:
+            break
+        hits = res.get("hits", {}).get("hits", [])
+        # Update scroll_id if changed
+        scroll_id = res.get("_scroll_id", scroll_id)
+
+    if rows:
+        runs.append(write_run(idx_dir, slice_id, len(runs), rows))
+
+    # Clear scroll context
+    if scroll_id:
+        es_request("DELETE", "_search/scroll", {"scroll_id": scroll_id})
+
+    return total_docs, runs
+
+def scroll_hits(idx, body):
+    """
+    Yield all hits of a search with the scroll API.
+    Raises RuntimeError if a scroll page could not be read.
+    """
+    res = es_request("POST", f"{idx}/_search?scroll=1m", dict(body, size=SCROLL_SIZE))
+    if not res:
+        raise RuntimeError(f"search on {idx} failed")
+    scroll_id = res.get("_scroll_id")
+    try:
+        hits = res.get("hits", {}).get("hits", [])
+        while hits:
+            yield from hits
+            res = es_request("POST", "_search/scroll", {"scroll": "1m", "scroll_id": scroll_id})
+            if not res:
+                raise RuntimeError(f"scroll on {idx} failed")
+            hits = res.get("hits", {}).get("hits", [])
+            scroll_id = res.get("_scroll_id", scroll_id)
+    finally:
+        if scroll_id:
+            es_request("DELETE", "_search/scroll", {"scroll_id": scroll_id})
+
+def has_hwm_field(schema_path):
+    """
+    True if the exported mapping has HWM_FIELD as a date field.
+    """
+    with open(schema_path, "r", encoding="utf-8") as f:
+        properties = json.load(f).get("mappings", {}).get("properties", {})
+    return properties.get(HWM_FIELD, {}).get("type") == "date"
+
+def fetch_high_water_mark(idx):
+    """
+    Current max of HWM_FIELD in epoch millis, or None if no document has it.
+    """
+    res = es_request("POST", f"{idx}/_search", {
+        "size": 0,
+        "aggs": {"hwm": {"max": {"field": HWM_FIELD}}}
+    })
+    if not res:
+        raise RuntimeError(f"high-water mark query on {idx} failed")
+    value = res.get("aggregations", {}).get("hwm", {}).get("value")
+    return int(value) if value is not None else None
+
+def changed_docs(idx, bounds):
+    """
+    (key, source) of the documents whose HWM_FIELD is within `bounds`
+    (a range query in epoch millis).
+    """
+    query = {"range": {HWM_FIELD: dict(bounds, format="epoch_millis")}}
+    return [(snapshot_format.delta_key(doc["_source"], idx), doc["_source"])
+            for doc in scroll_hits(idx, {"query": query, "sort": ["_doc"]})]
+
+def exported_digests(idx_dir, entry, keys, idx):
+    """
+    {key: source_digest} of the exported documents (delta layers applied) among `keys`.
+    """
+    digests = {}
+    for line in snapshot_format.iter_data_lines(idx_dir, entry):
+        source = json.loads(line)
+        key = snapshot_format.delta_key(source, idx)
+        if key in keys:
+            digests[key] = snapshot_format.source_digest(source)
+    return digests
+
+def export_delta(idx, idx_dir, entry):
+    """
+    Append a delta layer with documents changed since the recorded high-water
+    mark and documents deleted since the last export. Returns the updated
+    manifest entry (unchanged if nothing changed).
+    Raises snapshot_format.MissingDeltaKey if a document has no key field.
+    """
+    since = entry["high_water_mark"]
+    # Fix the upper bound first: anything updated while we read lands in the next delta
+    until = fetch_high_water_mark(idx)
+
+    upserts = []
+    if until is not None and (since is None or until >= since):
+        upserts = changed_docs(idx, {"gt": since, "lte": until} if since is not None else {"lte": until})
+    if until is not None and since is not None:
+        # Documents updated in the same millisecond as the last high-water mark
+        # may not have been read by the last export: keep those that differ from it
+        boundary = changed_docs(idx, {"gte": since, "lte": since})
+        if boundary:
+            exported = exported_digests(idx_dir, entry, {key for key, _ in boundary}, idx)
+            upserts += [(key, source) for key, source in boundary
+                        if exported.get(key) != snapshot_format.source_digest(source)]
+
+    # Deletions: compare keys only, sources are never transferred
+    live = set()
+    for doc in scroll_hits(idx, {"_source": [snapshot_format.DELTA_KEY_FIELD], "sort": ["_doc"]}):
+        live.add(snapshot_format.delta_key(doc["_source"], idx))
+    known = snapshot_format.read_ids(idx_dir, entry)
+    deleted = sorted(known - live)
+
+    entry = dict(entry, high_water_mark=until if until is not None else since)
+    if not upserts and not deleted:
+        print(f"   ✅ [{idx}] Unchanged since last export.")
+        return entry
+
+    deltas = list(entry.get("deltas", []))
+    name = snapshot_format.delta_file_name(len(deltas) + 1, SNAPSHOT_COMPRESSION)
+    path = os.path.join(idx_dir, name)
+    with snapshot_format.open_data_writer(path, SNAPSHOT_COMPRESSION) as out:
+        for key in deleted:
+            out.write((json.dumps({"op": "delete", "id": key}) + "\n").encode("utf-8"))
+        for key, source in sorted(upserts, key=lambda row: row[0]):
+            op = {"op": "index", "id": key, "source": source}
+            out.write((json.dumps(op, ensure_ascii=False) + "\n").encode("utf-8"))
+
+    deltas.append({
+        "file": name,
+        "compression": SNAPSHOT_COMPRESSION,
+        "upserts": len(upserts),
+        "deletes": len(deleted),
+        "sha256": snapshot_format.file_checksum(path),
+    })
+    entry.setdefault("base_docs", entry["docs"])
+    entry.update(deltas=deltas, docs=len(live))
+    print(f"   ✅ [{idx}] Delta saved: {name} ({len(upserts)} changed, {len(deleted)} deleted).")
+    return entry
+
+def merge_runs(run_paths, output_path):
+    """
+    K-way merge of sorted runs into the data file (ordered by _id, so the output
+    does not depend on the number of slices or on scroll order).
+    """
+    files = [open(path, "r", encoding="utf-8") for path in run_paths]
+    try:
+        with snapshot_format.open_data_writer(output_path, SNAPSHOT_COMPRESSION) as out:
+            for row in heapq.merge(*files):
+                out.write(row.split("\t", 1)[1].encode("utf-8"))
+    finally:
+        for f in files:
+            f.close()
+
+def export_index(idx, previous=None):
+    """
+    Export schema and data of one index using parallel scroll slices.
+    With a previous manifest entry that has a high-water mark and an unchanged
+    schema, only a delta layer is written. Returns the manifest entry of the
+    index, or None on failure.
+    """
+    print(f"👉 Processing index: {idx}")
+    idx_dir = os.path.join(OUTPUT_DIR, idx)
+    os.makedirs(idx_dir, exist_ok=True)
+    for stale in glob.glob(os.path.join(idx_dir, ".slice-*.tmp")):
+        os.remove(stale)
+
+    # --- A. Export Settings and Mappings (schema.json is replaced once the data is saved) ---
+    schema_path = export_schema(idx, idx_dir)
+    if not schema_path:
+        print(f"   ❌ [{idx}] Failed to read settings and mappings.")
+        return None
+    try:
+        return export_data(idx, idx_dir, schema_path, previous)
+    finally:
+        if os.path.exists(schema_path):
+            os.remove(schema_path)
+
+def export_data(idx, idx_dir, schema_path, previous=None):
+    """
+    Export the data of one index: a delta layer on top of `previous` if
+    possible, otherwise a full export. The schema at `schema_path` is
+    committed once the data is. Returns the manifest entry, or None on failure.
+    """
+    tracked = has_hwm_field(schema_path)
+
+    if (previous and tracked and "high_water_mark" in previous
+            and previous.get("schema_sha256") == snapshot_format.file_checksum(schema_path)):
+        try:
+            entry = export_delta(idx, idx_dir, previous)
+            commit_schema(idx, schema_path)
+            return entry
+        except snapshot_format.MissingDeltaKey as e:
+            # Deletions could not be matched to base documents: only a full export is safe
+            print(f"   ⚠️ [{idx}] Cannot export incrementally ({e}), exporting in full.")
+        except RuntimeError as e:
+            print(f"   ❌ [{idx}] Incremental export failed: {e}")
+            return None
+
+    # Taken before reading so concurrent updates are picked up by the next delta
+    try:
+        hwm = fetch_high_water_mark(idx) if tracked else None
+    except RuntimeError as e:
+        print(f"   ❌ [{idx}] {e}")
+        return None
+
+    # --- B. Export Data (Using sliced Scroll API) ---
+    count = (es_request("GET", f"{idx}/_count") or {}).get("count", 0)
+    max_slices = max(1, min(EXPORT_SLICES, count // SCROLL_SIZE))
+
+    with ThreadPoolExecutor(max_workers=max_slices) as pool:
+        results = list(pool.map(
+            lambda slice_id: export_slice(idx, idx_dir, slice_id, max_slices),
+            range(max_slices)
+        ))
+
+    data_name = snapshot_format.data_file_name(SNAPSHOT_COMPRESSION)
+    run_paths = [path for _, runs in results for path in runs]
+    try:
+        if any(docs is None for docs, _ in results):
+            print(f"   ❌ [{idx}] Failed to read data.")
+            return None
+        merge_runs(run_paths, os.path.join(idx_dir, data_name))
+    finally:
+        for path in run_paths:
+            os.remove(path)
+    snapshot_format.remove_other_data_files(idx_dir, data_name)
+    snapshot_format.remove_deltas(idx_dir)
+
+    total_docs = sum(docs for docs, _ in results)
+    print(f"   ✅ [{idx}] Data saved: {total_docs} documents ({max_slices} slice(s)).")
+    commit_schema(idx, schema_path)
+    entry = snapshot_format.build_index_entry(idx_dir, SNAPSHOT_COMPRESSION, docs=total_docs)
+    if tracked:
+        entry["high_water_mark"] = hwm
+    return entry
+
+def update_manifest(exported):
+    """
+    Merge the entries of this export into manifest.json. Indices exported
+    earlier keep their entry; legacy directories get one computed from their files.
+    """
+    indices = {}
+    for name, entry in snapshot_format.list_indices(OUTPUT_DIR).items():
+        idx_dir = os.path.join(OUTPUT_DIR, name)
+        if "sha256" in entry:
+            indices[name] = entry
+        elif os.path.exists(os.path.join(idx_dir, entry["data_file"])):
+            indices[name] = snapshot_format.build_index_entry(idx_dir, entry["compression"])
+    indices.update(exported)
+    snapshot_format.write_manifest(OUTPUT_DIR, indices)
+    print(f"📝 Manifest updated ({len(indices)} indices).")
+
 def main():
+    parser = argparse.ArgumentParser(description="Export Coco indices to the snapshot repo")
+    parser.add_argument("--incremental", action="store_true",
+                        help=f"Only export changes since the last export as delta layers "
+                             f"(indices without a '{HWM_FIELD}' date field are exported in full)")
+    args = parser.parse_args()
+
+    if SNAPSHOT_COMPRESSION not in snapshot_format.COMPRESSIONS:
+        print(f"❌ Unsupported SNAPSHOT_COMPRESSION: {SNAPSHOT_COMPRESSION}")
+        return
+
     print(f"🚀 Starting export for pattern: {INDEX_PATTERN} -> {OUTPUT_DIR}")
     
     # 1. Get list of indices
@@ -83,72 +432,17 @@ def main():
 
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-    for idx in index_names:
-        print(f"👉 Processing index: {idx}")
-        idx_dir = os.path.join(OUTPUT_DIR, idx)
-        os.makedirs(idx_dir, exist_ok=True)
-
-        # --- A. Export Settings and Mappings ---
-        meta = es_request("GET", idx)
-        if meta and idx in meta:
-            original_settings = meta[idx].get("settings", {})
-            mappings = meta[idx].get("mappings", {})
-            
-            # Clean settings
-            cleaned_settings = clean_settings(original_settings)
-            
-            # Build Schema Structure
-            schema = {
-                "settings": cleaned_settings,
-                "mappings": mappings
-            }
-            
-            with open(os.path.join(idx_dir, "schema.json"), "w", encoding="utf-8") as f:
-                json.dump(schema, f, ensure_ascii=False, indent=2)
-            print("   ✅ Schema saved.")
-        
-        # --- B. Export Data (Using Scroll API) ---
-        scroll_size = 1000
-        # Initialize scroll
-        init_scroll = es_request("POST", f"{idx}/_search?scroll=1m", {
-            "size": scroll_size,
-            "query": {"match_all": {}},
-            "sort": ["_doc"]
-        })
+    previous = {}
+    if args.incremental:
+        previous = (snapshot_format.load_manifest(OUTPUT_DIR) or {}).get("indices", {})
 
-        if not init_scroll:
-            print("   ❌ Failed to read data.")
-            continue
-
-        scroll_id = init_scroll.get("_scroll_id")
-        hits = init_scroll.get("hits", {}).get("hits", [])
-        total_docs = 0
-
-        with open(os.path.join(idx_dir, "data.jsonl"), "w", encoding="utf-8") as f:
-            while hits:
-                for doc in hits:
-                    # Write source data (one JSON per line)
-                    f.write(json.dumps(doc["_source"], ensure_ascii=False) + "\n")
-                    total_docs += 1
-                
-                # Fetch next batch
-                scroll_res = es_request("POST", "_search/scroll", {
-                    "scroll": "1m",
-                    "scroll_id": scroll_id
-                })
-                
-                if not scroll_res:
-                    break
-                    
-                hits = scroll_res.get("hits", {}).get("hits", [])
-                # Update scroll_id if changed
-                scroll_id = scroll_res.get("_scroll_id", scroll_id)
-
-        # Clear scroll context
-        if scroll_id:
-            es_request("DELETE", "_search/scroll", {"scroll_id": scroll_id})
+    # 2. Export indices in parallel
+    with ThreadPoolExecutor(max_workers=EXPORT_WORKERS) as pool:
+        entries = dict(zip(index_names, pool.map(
+            lambda idx: export_index(idx, previous.get(idx)), index_names)))
 
-        print(f"   ✅ Data saved: {total_docs} documents.")
+    # 3. Record counts, sizes and checksums
+    update_manifest({name: entry for name, entry in entries.items() if entry})
 
     print("\n🎉 All tasks completed!")
 
@@ -2,10 +2,15 @@ import os
 import sys
 import json
 import time
-import base64
-import ssl
-import urllib.request
-import urllib.error
+import random
+import argparse
+import threading
+import http.client
+from queue import Queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import snapshot_format
+from es_client import EsClient, read_bulk_response
 
 # ================= CONFIGURATION =================
 # Easysearch URL
@@ -13,71 +18,465 @@ ES_ENDPOINT = os.getenv("ES_ENDPOINT", "https://localhost:9200")
 # Credentials
 ES_USERNAME = os.getenv("ES_USERNAME", "elastic")
 ES_PASSWORD = os.getenv("ES_PASSWORD", "changeme")
+# Max pooled keep-alive connections (= max requests in flight)
+ES_MAX_CONNECTIONS = int(os.getenv("ES_MAX_CONNECTIONS", "16"))
+# Max time to wait for the cluster to become available (seconds)
+ES_WAIT_TIMEOUT = int(os.getenv("ES_WAIT_TIMEOUT", "60"))
 # Data input directory
 INPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "repo")
 
 # Pattern to clean before restoring (Ensures a completely clean slate)
 # This matches your requirement to delete "coco_*" before starting
 CLEANUP_PATTERN = "coco_*" 
-# =============================================
 
-# 1. Setup SSL Context (Ignore self-signed certificate errors)
-ctx = ssl.create_default_context()
-ctx.check_hostname = False
-ctx.verify_mode = ssl.CERT_NONE
+# Prefix of the exported index names; restored indices can be renamed to another
+# prefix (--index-prefix) so that parallel test slots don't share indices
+SOURCE_PREFIX = "coco_"
+INDEX_PREFIX = SOURCE_PREFIX
 
-# 2. Setup Basic Auth Headers
-auth_str = f"{ES_USERNAME}:{ES_PASSWORD}"
-auth_bytes = auth_str.encode("ascii")
-base64_auth = base64.b64encode(auth_bytes).decode("ascii")
+# Server-side timeout of the post-restore `_cluster/health` readiness barrier
+ES_HEALTH_TIMEOUT = os.getenv("ES_HEALTH_TIMEOUT", "30s")
+# Number of indices created in parallel (index creation is cheap, data loading is not)
+CREATE_WORKERS = int(os.getenv("CREATE_WORKERS", "8"))
+# Number of indices loaded in parallel
+RESTORE_WORKERS = int(os.getenv("RESTORE_WORKERS", "4"))
+# Max in-flight _bulk requests per index
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "2"))
+# A _bulk request is flushed at whichever limit is reached first
+BULK_BATCH_DOCS = int(os.getenv("BULK_BATCH_DOCS", "500"))
+BULK_BATCH_BYTES = int(os.getenv("BULK_BATCH_BYTES", str(5 * 1024 * 1024)))
+# Backpressure: retries and backoff (seconds) on 429 / rejected bulk items
+BULK_MAX_RETRIES = int(os.getenv("BULK_MAX_RETRIES", "8"))
+BULK_BACKOFF_BASE = 0.2
+BULK_BACKOFF_MAX = 10.0
+# gzip _bulk request bodies and accept gzip responses; worth it when
+# Easysearch runs on another host or container and bytes on the wire dominate
+BULK_COMPRESSION = os.getenv("BULK_COMPRESSION", "false").lower() == "true"
 
-COMMON_HEADERS = {
-    "Authorization": f"Basic {base64_auth}",
-    "Content-Type": "application/json"
+# Bulk-load profile applied to non-empty indices while their data is loaded;
+# the schema.json values (or the defaults) are put back afterwards
+LOAD_PROFILE = {
+    "refresh_interval": "-1",
+    "translog": {"durability": "async"},
 }
+# Merge each loaded index down to one segment before the final refresh
+RESTORE_FORCEMERGE = os.getenv("RESTORE_FORCEMERGE", "false").lower() == "true"
+
+# Fast reset: baseline snapshot kept in a local fs repository.
+# The location must be listed in the node's `path.repo` setting.
+SNAPSHOT_REPO = os.getenv("SNAPSHOT_REPO", "coco_test_baseline")
+SNAPSHOT_REPO_PATH = os.getenv("SNAPSHOT_REPO_PATH", "/app/easysearch/data/snapshots")
+SNAPSHOT_NAME = os.getenv("SNAPSHOT_NAME", "baseline")
+# Exit code when the data was imported but the snapshot could not be saved
+EXIT_SNAPSHOT_NOT_SAVED = 3
+
+# Optional JSON-lines timing output (set by run_integration_tests.py)
+TIMINGS_FILE = os.getenv("TIMINGS_FILE", "")
+TIMINGS_SCENARIO = os.getenv("TIMINGS_SCENARIO", "")
+TIMINGS_SLOT = os.getenv("TIMINGS_SLOT", "")
+# =============================================
+
+# Shared keep-alive connection pool (one TLS handshake per connection, not per request)
+es = EsClient(ES_ENDPOINT, ES_USERNAME, ES_PASSWORD, max_connections=ES_MAX_CONNECTIONS)
+
+_timings_lock = threading.Lock()
+
+def record_span(name, start, **attrs):
+    """
+    Append a timing span (JSON line) to TIMINGS_FILE, if enabled.
+    """
+    if not TIMINGS_FILE:
+        return
+    record = {
+        "span": name,
+        "scenario": TIMINGS_SCENARIO,
+        "slot": TIMINGS_SLOT,
+        "start": round(start, 3),
+        "duration": round(time.time() - start, 3),
+        "status": "ok",
+        **attrs,
+    }
+    with _timings_lock, open(TIMINGS_FILE, "a") as f:
+        f.write(json.dumps(record) + "\n")
 
 def es_request(method, endpoint, body=None):
     """
     Standard HTTP request wrapper with Auth and SSL support.
+    HTTP errors come back as {"error": status, "msg": ...} (e.g. 404 is fine during delete).
     """
-    url = f"{ES_ENDPOINT}/{endpoint.lstrip('/')}"
-    data = json.dumps(body).encode("utf-8") if body else None
-    
-    req = urllib.request.Request(url, data=data, headers=COMMON_HEADERS, method=method)
-    
     try:
-        with urllib.request.urlopen(req, context=ctx) as response:
-            return json.loads(response.read().decode("utf-8"))
-    except urllib.error.HTTPError as e:
-        # Return error details for handling (e.g., 404 is fine during delete)
-        return {"error": e.code, "msg": e.read().decode('utf-8')}
+        return es.request(method, endpoint, body)
     except Exception as e:
         print(f"Error: {e}")
         return None
 
 def wait_for_es():
     """
-    Wait for Easysearch to be healthy.
+    Wait for Easysearch to be healthy (cluster status at least yellow).
+    Probes back off exponentially from 50ms; once the node answers, the
+    cluster health API waits server-side for the yellow status.
     """
     print(f"Waiting for Easysearch at {ES_ENDPOINT}...")
-    url = f"{ES_ENDPOINT}/_cluster/health"
-    req = urllib.request.Request(url, headers=COMMON_HEADERS, method="GET")
-    
-    for i in range(30):
+    start = time.time()
+    delay = 0.05
+    while time.time() - start < ES_WAIT_TIMEOUT:
         try:
-            with urllib.request.urlopen(req, context=ctx) as response:
-                if response.status == 200:
-                    print("Easysearch is up!")
-                    return
+            status, _ = es.call("GET", "_cluster/health?wait_for_status=yellow&timeout=10s", retries=0)
+            if status == 200:
+                print(f"Easysearch is up! ({time.time() - start:.2f}s)")
+                return
         except Exception:
-            time.sleep(1)
+            # Not listening yet, or 408 when the server-side wait timed out
+            pass
+        time.sleep(delay)
+        delay = min(delay * 2, 1.0)
     print("Timeout waiting for Easysearch")
 
-def main():
-    wait_for_es()
-    
-    # --- STEP 0: Global Cleanup ---
-    # Delete all indices matching the pattern to ensure a clean slate.
+# Shared backpressure state: when Easysearch pushes back, every sender pauses
+_throttle_lock = threading.Lock()
+_throttle_until = 0.0
+
+def throttle(attempt):
+    """
+    Register backpressure and pause all bulk senders with exponential backoff + jitter.
+    """
+    global _throttle_until
+    delay = min(BULK_BACKOFF_MAX, BULK_BACKOFF_BASE * (2 ** attempt))
+    delay = delay / 2 + random.uniform(0, delay / 2)
+    with _throttle_lock:
+        _throttle_until = max(_throttle_until, time.time() + delay)
+
+def wait_for_throttle():
+    """
+    Block while a backpressure pause is active.
+    """
+    while True:
+        with _throttle_lock:
+            remaining = _throttle_until - time.time()
+        if remaining <= 0:
+            return
+        time.sleep(remaining)
+
+BULK_HEADERS = {"Content-Type": "application/x-ndjson"}
+
+def post_bulk(body):
+    """
+    Send one _bulk request. Returns (http_status, failed_items), where
+    failed_items lists (position, item result) of the rejected documents (the
+    response is parsed as it streams in, successful items are not kept), or
+    the error text when the request itself failed.
+    The client does not resend a _bulk whose response was lost (the frames
+    carry no _id, a resent batch would be indexed twice): that raises.
+    """
+    with es.open("POST", "_bulk", body, BULK_HEADERS, compress=BULK_COMPRESSION) as (status, stream):
+        if status != 200:
+            return status, stream.read().decode("utf-8", errors="replace")
+        return status, read_bulk_response(stream)
+
+def send_bulk(idx_name, frames, offsets):
+    """
+    Send a batch of pre-built bulk frames (action line + source line per doc).
+    offsets[i] is where the frame of document i starts in `frames`.
+    Retries the whole request on HTTP 429 and only the rejected items when the
+    response has `errors: true` with per-item 429s. Returns the number of failed docs.
+    """
+    body = frames
+    pending = list(zip(offsets, offsets[1:] + [len(frames)]))
+
+    for attempt in range(BULK_MAX_RETRIES + 1):
+        wait_for_throttle()
+        try:
+            status, res = post_bulk(body)
+        except (http.client.HTTPException, OSError) as e:
+            print(f"   ❌ Bulk Error ({idx_name}): {e} (not resent, the batch may have been applied)")
+            return len(pending)
+
+        if status == 429:
+            throttle(attempt)
+            continue
+        if status != 200:
+            print(f"   ❌ Bulk Error ({idx_name}): HTTP {status} {res}")
+            return len(pending)
+        if not res:
+            return 0
+
+        # Keep only the items that were rejected due to backpressure
+        retry, failed = [], 0
+        for position, result in res:
+            if result.get("status") == 429:
+                retry.append(pending[position])
+            else:
+                failed += 1
+                if failed <= 3:
+                    print(f"   ❌ Bulk item error ({idx_name}): {result.get('error')}")
+        if failed:
+            print(f"   ❌ {failed} document(s) rejected in {idx_name}")
+        if not retry:
+            return failed
+
+        pending = retry
+        body = b"".join(frames[start:end] for start, end in pending)
+        throttle(attempt)
+
+    print(f"   ❌ Giving up on {len(pending)} document(s) in {idx_name} after {BULK_MAX_RETRIES} retries")
+    return len(pending)
+
+def stream_bulk(idx_name, lines):
+    """
+    Stream source lines (see snapshot_format.iter_data_lines) into _bulk requests
+    without decoding the documents.
+    Frames are appended to a small set of reusable bytearrays: one is being
+    filled while the others are in flight, so memory stays bounded by
+    (BULK_CONCURRENCY + 1) * BULK_BATCH_BYTES regardless of the file size.
+    Returns (doc_count, failed_count).
+    """
+    meta = json.dumps({"index": {"_index": idx_name}}).encode("utf-8") + b"\n"
+
+    # Free buffers; taking one blocks while all are in flight (backpressure)
+    buffers = Queue()
+    for _ in range(BULK_CONCURRENCY + 1):
+        buffers.put(bytearray())
+
+    failed = 0
+    failed_lock = threading.Lock()
+
+    def send(buf, offsets):
+        nonlocal failed
+        start = time.time()
+        try:
+            n = send_bulk(idx_name, buf, offsets)
+            with failed_lock:
+                failed += n
+            record_span("restore.bulk", start, index=idx_name, docs=len(offsets), bytes=len(buf), failed=n)
+        finally:
+            del buf[:]
+            buffers.put(buf)
+
+    doc_count = 0
+    with ThreadPoolExecutor(max_workers=BULK_CONCURRENCY) as pool:
+        futures = []
+        buf = buffers.get()
+        offsets = []
+        for line in lines:
+            offsets.append(len(buf))
+            buf += meta
+            buf += line
+            buf += b"\n"
+            doc_count += 1
+
+            if len(offsets) >= BULK_BATCH_DOCS or len(buf) >= BULK_BATCH_BYTES:
+                futures.append(pool.submit(send, buf, offsets))
+                buf, offsets = buffers.get(), []
+                print(f"   Indexed batch... ({idx_name}: {doc_count} docs so far)")
+
+        # Process remaining documents
+        if offsets:
+            futures.append(pool.submit(send, buf, offsets))
+
+        # Surface exceptions raised by the senders
+        for future in futures:
+            future.result()
+
+    return doc_count, failed
+
+def target_index(dir_name):
+    """
+    Map an exported index name to the name it is restored under.
+    """
+    if dir_name.startswith(SOURCE_PREFIX):
+        return INDEX_PREFIX + dir_name[len(SOURCE_PREFIX):]
+    return dir_name
+
+def index_unchanged(idx_name, entry):
+    """
+    True if the live index was restored from this exact snapshot entry (same
+    checksums recorded in the mapping _meta) and nothing was written to it since:
+    every write consumes a sequence number, so the primaries' max_seq_no + 1
+    must still add up to the number of restored documents.
+    """
+    if "sha256" not in entry:
+        return False
+
+    res = es_request("GET", f"{idx_name}/_mapping")
+    if not res or idx_name not in res:
+        return False
+    meta = res[idx_name].get("mappings", {}).get("_meta", {})
+    if meta.get("snapshot_sha256") != snapshot_format.entry_fingerprint(entry) or meta.get("schema_sha256") != entry["schema_sha256"]:
+        return False
+
+    res = es_request("GET", f"{idx_name}/_stats/docs?level=shards")
+    if not res or "error" in res:
+        return False
+    shards = res.get("indices", {}).get(idx_name, {}).get("shards", {})
+    ops = sum(
+        copy["seq_no"]["max_seq_no"] + 1
+        for copies in shards.values() for copy in copies
+        if copy.get("routing", {}).get("primary")
+    )
+    return ops == entry["docs"]
+
+def has_data(idx_path, entry):
+    """
+    True if the index has documents to load. Uses the manifest count when
+    available, otherwise the data file size, so empty indices need no file I/O.
+    """
+    if "docs" in entry:
+        return entry["docs"] > 0
+    data_path = os.path.join(idx_path, entry["data_file"])
+    return os.path.exists(data_path) and os.path.getsize(data_path) > 0
+
+def apply_load_profile(index_settings, profile=LOAD_PROFILE):
+    """
+    Overlay `profile` onto index settings in place. Returns the values it
+    replaced (None where the setting was unset), in the same shape.
+    """
+    original = {}
+    for key, value in profile.items():
+        if isinstance(value, dict):
+            nested = index_settings.setdefault(key, {})
+            original[key] = apply_load_profile(nested, value)
+        else:
+            original[key] = index_settings.get(key)
+            index_settings[key] = value
+    return original
+
+def plan_restore(indices, skip=()):
+    """
+    Read every schema up front and describe what restoring each index takes.
+    Indices with data are created with LOAD_PROFILE; `settings` holds what to
+    put back once they are loaded.
+    Returns a list of tasks: {dir, index, path, entry, schema, load, settings}.
+    """
+    tasks = []
+    for dir_name, entry in indices.items():
+        idx_name = target_index(dir_name)
+        if idx_name in skip:
+            continue
+        idx_path = os.path.join(INPUT_DIR, dir_name)
+        schema = None
+        schema_path = os.path.join(idx_path, snapshot_format.SCHEMA_FILE)
+        if os.path.exists(schema_path):
+            with open(schema_path, "r", encoding="utf-8") as f:
+                schema = json.load(f)
+
+            # Optimization for CI: Force replicas to 0
+            if "settings" in schema and "index" in schema["settings"]:
+                schema["settings"]["index"]["number_of_replicas"] = 0
+
+            # Remember which snapshot the index came from (see index_unchanged)
+            if "sha256" in entry:
+                schema.setdefault("mappings", {}).setdefault("_meta", {}).update({
+                    "snapshot_sha256": snapshot_format.entry_fingerprint(entry),
+                    "schema_sha256": entry["schema_sha256"],
+                })
+        load = has_data(idx_path, entry)
+        settings = None
+        if load and schema is not None:
+            settings = apply_load_profile(schema.setdefault("settings", {}).setdefault("index", {}))
+        tasks.append({
+            "dir": dir_name,
+            "index": idx_name,
+            "path": idx_path,
+            "entry": entry,
+            "schema": schema,
+            "load": load,
+            "settings": settings,
+        })
+    return tasks
+
+def create_index(task):
+    """
+    Create an index from its planned schema. Returns True on success.
+    """
+    if task["schema"] is None:
+        return True
+    res = es_request("PUT", task["index"], task["schema"])
+    if res and "error" in res:
+        print(f"   ❌ Create Error ({task['index']}): {res}")
+        return False
+    return True
+
+def load_index(task):
+    """
+    Bulk load the data of one created index, with delta layers applied
+    (up to BULK_CONCURRENCY requests in flight). Returns (doc_count, failed_count).
+    """
+    idx_name = task["index"]
+    print(f"📦 Loading index: {idx_name}...")
+    start = time.time()
+    doc_count, failed = stream_bulk(idx_name, snapshot_format.iter_data_lines(task["path"], task["entry"]))
+    record_span("restore.index", start, index=idx_name, docs=doc_count, failed=failed)
+    print(f"   ✅ Done restoring {idx_name} ({doc_count} docs, {failed} failed).")
+    return doc_count, failed
+
+def finish_load(tasks):
+    """
+    Put the original settings back on loaded indices (one request per distinct
+    set of values) and optionally force-merge them.
+    """
+    groups = {}
+    for task in tasks:
+        if task["settings"] is not None:
+            groups.setdefault(json.dumps(task["settings"], sort_keys=True), []).append(task["index"])
+    for settings, names in groups.items():
+        res = es_request("PUT", f"{','.join(names)}/_settings", {"index": json.loads(settings)})
+        if not res or "error" in res:
+            print(f"   ⚠️ Failed to restore settings of {names}: {res}")
+
+    if RESTORE_FORCEMERGE and tasks:
+        names = ",".join(task["index"] for task in tasks)
+        print(f"🗜️  Force-merging {len(tasks)} index(es)...")
+        es_request("POST", f"{names}/_forcemerge?max_num_segments=1")
+
+def wait_for_restored():
+    """
+    Single barrier after a restore: one refresh of all restored indices, then
+    wait until their shards are active, so callers need no fixed sleep.
+    """
+    start = time.time()
+    es_request("POST", f"{CLEANUP_PATTERN}/_refresh")
+    res = es_request("GET", f"_cluster/health/{CLEANUP_PATTERN}?wait_for_status=yellow&timeout={ES_HEALTH_TIMEOUT}")
+    status = (res or {}).get("status")
+    record_span("restore.barrier", start, health=status)
+    if status in ("green", "yellow"):
+        print(f"   ✅ Indices ready ({status}) in {time.time() - start:.2f}s")
+    else:
+        print(f"   ⚠️ Indices not ready after refresh: {res}")
+
+def stray_indices():
+    """Indices matching CLEANUP_PATTERN that no index of the snapshot repo restores to"""
+    if not os.path.isdir(INPUT_DIR):
+        return []
+    fixtures = {target_index(name) for name in snapshot_format.list_indices(INPUT_DIR)}
+    res = es_request("GET", f"_cat/indices/{CLEANUP_PATTERN}?format=json&h=index")
+    return [x["index"] for x in (res if isinstance(res, list) else []) if x["index"] not in fixtures]
+
+def cleanup_indices(keep=(), only=None):
+    """
+    Delete all indices matching CLEANUP_PATTERN, except those in `keep`.
+    With `only`, delete just those (restored) index names, plus any index
+    matching CLEANUP_PATTERN that is not in the snapshot repo at all (created
+    by the server or a test since the last reset).
+    """
+    if only is not None:
+        names = sorted((set(only) | set(stray_indices())) - set(keep))
+        print(f"🧹 Cleaning up {len(names)} index(es): {names}")
+        if names:
+            res = es_request("DELETE", f"{','.join(names)}?ignore_unavailable=true")
+            if not res or "error" in res:
+                print(f"   ⚠️ Cleanup response: {res}")
+        return
+
+    if keep:
+        res = es_request("GET", f"_cat/indices/{CLEANUP_PATTERN}?format=json&h=index")
+        stale = sorted(x["index"] for x in (res if isinstance(res, list) else []) if x["index"] not in keep)
+        print(f"🧹 Cleaning up {len(stale)} index(es) matching {CLEANUP_PATTERN}, keeping {len(keep)} unchanged")
+        if stale:
+            res = es_request("DELETE", ",".join(stale))
+            if not res or "error" in res:
+                print(f"   ⚠️ Cleanup response: {res}")
+        return
+
     print(f"🧹 Performing global cleanup for pattern: {CLEANUP_PATTERN}...")
     res = es_request("DELETE", CLEANUP_PATTERN)
     
@@ -88,84 +487,172 @@ def main():
     else:
         print(f"   ⚠️ Cleanup response: {res}")
 
-    # --- STEP 1: Restore from Files ---
+def save_snapshot():
+    """
+    Register the fs repository and (re)create the baseline snapshot of CLEANUP_PATTERN.
+    Returns True on success.
+    """
+    print(f"📸 Saving baseline snapshot {SNAPSHOT_REPO}/{SNAPSHOT_NAME} ({SNAPSHOT_REPO_PATH})...")
+    res = es_request("PUT", f"_snapshot/{SNAPSHOT_REPO}", {
+        "type": "fs",
+        "settings": {"location": SNAPSHOT_REPO_PATH}
+    })
+    if not res or "error" in res:
+        print(f"   ⚠️ Snapshot repository registration failed: {res}")
+        return False
+
+    # Replace the snapshot of a previous run, if any
+    es_request("DELETE", f"_snapshot/{SNAPSHOT_REPO}/{SNAPSHOT_NAME}")
+
+    res = es_request("PUT", f"_snapshot/{SNAPSHOT_REPO}/{SNAPSHOT_NAME}?wait_for_completion=true", {
+        "indices": CLEANUP_PATTERN,
+        "include_global_state": False
+    })
+    state = (res or {}).get("snapshot", {}).get("state")
+    if state != "SUCCESS":
+        print(f"   ⚠️ Snapshot failed: {res}")
+        return False
+
+    print("   ✅ Baseline snapshot saved.")
+    return True
+
+def restore_snapshot(only=None):
+    """
+    Replace all CLEANUP_PATTERN indices (or just the `only` exported indices)
+    with the baseline snapshot. Returns True on success.
+    """
+    print(f"⏪ Restoring baseline snapshot {SNAPSHOT_REPO}/{SNAPSHOT_NAME}...")
+    if only is None:
+        cleanup_indices()
+        pattern = CLEANUP_PATTERN
+    else:
+        targets = [target_index(name) for name in only]
+        cleanup_indices(only=targets)
+        pattern = ",".join(targets)
+    start = time.time()
+    res = es_request("POST", f"_snapshot/{SNAPSHOT_REPO}/{SNAPSHOT_NAME}/_restore?wait_for_completion=true", {
+        "indices": pattern,
+        "include_global_state": False
+    })
+    record_span("restore.snapshot", start, snapshot=SNAPSHOT_NAME)
+    shards = (res or {}).get("snapshot", {}).get("shards", {})
+    if not shards or shards.get("failed", 1) != 0:
+        print(f"   ⚠️ Snapshot restore failed: {res}")
+        return False
+
+    print(f"   ✅ Restored {len(res['snapshot'].get('indices', []))} indices from snapshot.")
+    wait_for_restored()
+    return True
+
+def import_from_files(skip_unchanged=False, only=None):
+    """
+    Recreate every index of the snapshot repo (or just the `only` ones) from
+    its schema and data file. With skip_unchanged, indices still identical to
+    the snapshot are kept as they are.
+    """
     if not os.path.exists(INPUT_DIR):
         print(f"❌ Data directory not found: {INPUT_DIR}")
         sys.exit(1)
 
-    # Iterate over exported index directories
-    for idx_name in os.listdir(INPUT_DIR):
-        idx_path = os.path.join(INPUT_DIR, idx_name)
-        if not os.path.isdir(idx_path):
-            continue
-            
-        print(f"📦 Restoring index: {idx_name}...")
-        
-        # A. Restore Schema (Settings & Mappings)
-        schema_path = os.path.join(idx_path, "schema.json")
-        if os.path.exists(schema_path):
-            with open(schema_path, "r", encoding="utf-8") as f:
-                schema = json.load(f)
-            
-            # Optimization for CI: Force replicas to 0
-            if "settings" in schema and "index" in schema["settings"]:
-                schema["settings"]["index"]["number_of_replicas"] = 0
+    indices = snapshot_format.list_indices(INPUT_DIR)
+    if only is not None:
+        missing = sorted(set(only) - set(indices))
+        if missing:
+            print(f"❌ Unknown index(es) requested: {missing}")
+            sys.exit(1)
+        indices = {name: indices[name] for name in only}
+
+    keep = set()
+    if skip_unchanged:
+        with ThreadPoolExecutor(max_workers=RESTORE_WORKERS) as pool:
+            unchanged = pool.map(lambda name: index_unchanged(target_index(name), indices[name]), indices)
+            keep = {target_index(name) for name, same in zip(list(indices), unchanged) if same}
+
+    cleanup_indices(keep, only=None if only is None else [target_index(name) for name in indices])
+
+    # --- STEP 1: Plan (all schemas read up front) ---
+    tasks = plan_restore(indices, skip=keep)
+    if keep:
+        print(f"⏭️  Skipping {len(keep)} unchanged index(es)")
+
+    start = time.time()
+    total_docs = 0
+    errors = []
+
+    # --- STEP 2: Create all indices concurrently ---
+    create_start = time.time()
+    with ThreadPoolExecutor(max_workers=CREATE_WORKERS) as pool:
+        created = list(pool.map(create_index, tasks))
+    record_span("restore.create", create_start, indices=len(tasks))
+    for task, ok in zip(tasks, created):
+        if not ok:
+            errors.append(f"{task['index']}: index creation failed")
+
+    # --- STEP 3: Load data in parallel, skipping empty indices ---
+    to_load = [task for task, ok in zip(tasks, created) if ok and task["load"]]
+    print(f"🏗️  Created {sum(created)} indices, loading {len(to_load)} non-empty one(s)")
+    with ThreadPoolExecutor(max_workers=RESTORE_WORKERS) as pool:
+        futures = {pool.submit(load_index, task): task["index"] for task in to_load}
+        for future in as_completed(futures):
+            idx_name = futures[future]
+            try:
+                doc_count, failed = future.result()
+            except Exception as e:
+                errors.append(f"{idx_name}: {e}")
+                continue
+            total_docs += doc_count
+            if failed:
+                errors.append(f"{idx_name}: {failed} document(s) failed")
+
+    # --- STEP 4: Undo the load profile, then one refresh / readiness barrier ---
+    finish_load(to_load)
+    wait_for_restored()
+
+    elapsed = time.time() - start
+    print(f"⏱️  Restored {len(tasks)} indices, {total_docs} docs in {elapsed:.2f}s")
+
+    if errors:
+        print("❌ Restore finished with errors:")
+        for err in errors:
+            print(f"   - {err}")
+        sys.exit(1)
+
+def main():
+    global INDEX_PREFIX, CLEANUP_PATTERN, SNAPSHOT_NAME
+
+    parser = argparse.ArgumentParser(description="Restore Coco test fixtures into Easysearch")
+    parser.add_argument("--index-prefix", default=SOURCE_PREFIX,
+                        help=f"Restore '{SOURCE_PREFIX}*' indices under this prefix instead")
+    parser.add_argument("--save-snapshot", action="store_true",
+                        help="After importing, save the result as the baseline snapshot")
+    parser.add_argument("--from-snapshot", action="store_true",
+                        help="Restore the baseline snapshot instead of re-importing (falls back to a full import)")
+    parser.add_argument("--skip-unchanged", action="store_true",
+                        help="Keep indices that still match the manifest checksums and were not written to")
+    parser.add_argument("--indices",
+                        help="Comma-separated exported index names to reset (default: all)")
+    args = parser.parse_args()
+    only = args.indices.split(",") if args.indices else None
+
+    if args.index_prefix != SOURCE_PREFIX:
+        INDEX_PREFIX = args.index_prefix
+        CLEANUP_PATTERN = f"{INDEX_PREFIX}*"
+        SNAPSHOT_NAME = f"{SNAPSHOT_NAME}-{INDEX_PREFIX.rstrip('_')}"
+
+    wait_for_es()
+
+    if args.from_snapshot:
+        if restore_snapshot(only):
+            return
+        print("   ↩️ Falling back to full import.")
+        args.save_snapshot = True
+        only = None
+
+    import_from_files(skip_unchanged=args.skip_unchanged, only=only)
 
-            # Create new index (No need to delete individual index, we did global cleanup)
-            res = es_request("PUT", idx_name, schema)
-            if res and "error" in res:
-                print(f"   ❌ Create Error: {res}")
-                continue # Skip data load if creation failed
-        
-        # B. Bulk Load Data
-        data_path = os.path.join(idx_path, "data.jsonl")
-        if os.path.exists(data_path):
-            bulk_body = []
-            doc_count = 0
-            
-            with open(data_path, "r", encoding="utf-8") as f:
-                for line in f:
-                    line = line.strip()
-                    if not line: 
-                        continue
-                        
-                    # Bulk format: metadata line + source line
-                    meta = json.dumps({"index": {"_index": idx_name}})
-                    bulk_body.append(meta)
-                    bulk_body.append(line)
-                    doc_count += 1
-                    
-                    # Send batch every 1000 lines (500 documents)
-                    if len(bulk_body) >= 1000:
-                        body_str = "\n".join(bulk_body) + "\n"
-                        
-                        bulk_headers = COMMON_HEADERS.copy()
-                        bulk_headers["Content-Type"] = "application/x-ndjson"
-
-                        req = urllib.request.Request(
-                            f"{ES_ENDPOINT}/_bulk", 
-                            data=body_str.encode('utf-8'), 
-                            headers=bulk_headers, 
-                            method="POST"
-                        )
-                        urllib.request.urlopen(req, context=ctx)
-                        bulk_body = []
-                        print(f"   Indexed batch... ({doc_count} docs so far)")
-
-                # Process remaining documents
-                if bulk_body:
-                    body_str = "\n".join(bulk_body) + "\n"
-                    bulk_headers = COMMON_HEADERS.copy()
-                    bulk_headers["Content-Type"] = "application/x-ndjson"
-                    req = urllib.request.Request(
-                        f"{ES_ENDPOINT}/_bulk", 
-                        data=body_str.encode('utf-8'), 
-                        headers=bulk_headers, 
-                        method="POST"
-                    )
-                    urllib.request.urlopen(req, context=ctx)
-            
-            print(f"   ✅ Done restoring {idx_name}.")
+    if args.save_snapshot and not save_snapshot():
+        print("❌ Data imported, but the baseline snapshot was not saved.")
+        sys.exit(EXIT_SNAPSHOT_NOT_SAVED)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
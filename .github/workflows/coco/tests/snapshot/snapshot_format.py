@@ -0,0 +1,349 @@
+"""
+Snapshot repository format shared by export_data_raw.py and import_data_raw.py.
+
+Layout (format version 2):
+
+    repo/
+      manifest.json            # format version + per-index doc counts, sizes, checksums
+      <index>/
+        schema.json            # settings + mappings
+        data.jsonl[.gz|.zst]   # base layer: one _source per line, optionally compressed
+        delta-0001.jsonl[...]  # optional delta layers from incremental exports
+
+A delta layer holds one operation per line, applied in order on top of the base:
+
+    {"op": "index", "id": "<id>", "source": {...}}
+    {"op": "delete", "id": "<id>"}
+
+Documents are identified by their DELTA_KEY_FIELD value (Coco stores the
+document _id in the `id` field). The manifest keeps, per index, the high-water
+mark of the last export and the list of delta layers.
+
+A repo without manifest.json is read as the legacy layout (plain data.jsonl).
+
+Run this file directly to (re)build the manifest of an existing repo, optionally
+recompressing its data files:
+
+    python3 snapshot_format.py [--compression none|gzip|zstd] [REPO_DIR]
+"""
+
+import io
+import os
+import sys
+import gzip
+import json
+import hashlib
+import argparse
+
+FORMAT_VERSION = 2
+MANIFEST_FILE = "manifest.json"
+SCHEMA_FILE = "schema.json"
+DATA_FILE = "data.jsonl"
+DELTA_KEY_FIELD = "id"
+
+# Compression name -> data file suffix
+COMPRESSIONS = {
+    "none": "",
+    "gzip": ".gz",
+    "zstd": ".zst",
+}
+
+DEFAULT_REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "repo")
+
+def data_file_name(compression):
+    """
+    Name of the data file for the given compression.
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unsupported compression: {compression} (expected one of {list(COMPRESSIONS)})")
+    return DATA_FILE + COMPRESSIONS[compression]
+
+def delta_file_name(seq, compression):
+    """
+    Name of the seq-th delta layer (1-based) for the given compression.
+    """
+    return f"delta-{seq:04d}.jsonl" + COMPRESSIONS[compression]
+
+def entry_fingerprint(entry):
+    """
+    Identity of everything an index is restored from: base data, schema and deltas.
+    """
+    deltas = entry.get("deltas", [])
+    if not deltas:
+        return entry["sha256"]
+    digest = hashlib.sha256(entry["sha256"].encode("ascii"))
+    for delta in deltas:
+        digest.update(delta["sha256"].encode("ascii"))
+    return digest.hexdigest()
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        print("❌ zstd compression requires the 'zstandard' package (pip install zstandard)")
+        sys.exit(1)
+    return zstandard
+
+def open_data_reader(path, compression="none"):
+    """
+    Open a data file for streaming binary line iteration, decompressing on the fly.
+    """
+    if compression == "gzip":
+        return gzip.open(path, "rb")
+    if compression == "zstd":
+        raw = open(path, "rb")
+        return io.BufferedReader(_zstd().ZstdDecompressor().stream_reader(raw, closefd=True))
+    return open(path, "rb")
+
+def open_data_writer(path, compression="none"):
+    """
+    Open a data file for binary writing, compressing on the fly.
+    """
+    if compression == "gzip":
+        # mtime=0 keeps the output byte-identical between exports
+        return gzip.GzipFile(path, "wb", compresslevel=6, mtime=0)
+    if compression == "zstd":
+        raw = open(path, "wb")
+        return _zstd().ZstdCompressor(level=10).stream_writer(raw, closefd=True)
+    return open(path, "wb")
+
+def file_checksum(path):
+    """
+    sha256 of a file's bytes as stored.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def count_docs(path, compression="none"):
+    """
+    Count non-empty lines of a data file.
+    """
+    count = 0
+    with open_data_reader(path, compression) as f:
+        for line in f:
+            if line.strip():
+                count += 1
+    return count
+
+def doc_key(source, fallback=None):
+    """
+    Key identifying a document across base and delta layers.
+    """
+    return source.get(DELTA_KEY_FIELD, fallback)
+
+class MissingDeltaKey(RuntimeError):
+    """
+    A document has no DELTA_KEY_FIELD: the base layer does not store _id, so
+    such an index cannot be exported incrementally.
+    """
+
+def delta_key(source, where):
+    """
+    doc_key() for delta bookkeeping, without a fallback: the key has to be
+    the same in the base layer (sources only) and in the live index.
+    Raises MissingDeltaKey if the document has no DELTA_KEY_FIELD.
+    """
+    key = source.get(DELTA_KEY_FIELD)
+    if key is None:
+        raise MissingDeltaKey(f"{where} has a document without the '{DELTA_KEY_FIELD}' key field")
+    return key
+
+def fold_deltas(idx_dir, entry):
+    """
+    Collapse the delta layers of an index into their net effect.
+    Returns (superseded, upserts): the keys whose base document must be dropped,
+    and {key: source line} of the latest version of every re-indexed document.
+    """
+    superseded, upserts = set(), {}
+    for delta in entry.get("deltas", []):
+        with open_data_reader(os.path.join(idx_dir, delta["file"]), delta["compression"]) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                op = json.loads(line)
+                superseded.add(op["id"])
+                if op["op"] == "delete":
+                    upserts.pop(op["id"], None)
+                else:
+                    upserts[op["id"]] = json.dumps(op["source"], ensure_ascii=False).encode("utf-8")
+    return superseded, upserts
+
+def iter_data_lines(idx_dir, entry):
+    """
+    Yield the source lines of an index with its delta layers applied.
+    Without deltas the base file is streamed as-is, without decoding.
+    """
+    base = os.path.join(idx_dir, entry["data_file"])
+    if not entry.get("deltas"):
+        if os.path.exists(base):
+            with open_data_reader(base, entry["compression"]) as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        yield line
+        return
+
+    superseded, upserts = fold_deltas(idx_dir, entry)
+    with open_data_reader(base, entry["compression"]) as f:
+        for line in f:
+            line = line.strip()
+            if line and delta_key(json.loads(line), f"base layer of {os.path.basename(idx_dir)}") not in superseded:
+                yield line
+    for key in sorted(upserts):
+        yield upserts[key]
+
+def read_ids(idx_dir, entry):
+    """
+    Set of document keys after applying all delta layers to the base layer.
+    Raises MissingDeltaKey if a base document has no DELTA_KEY_FIELD.
+    """
+    superseded, upserts = fold_deltas(idx_dir, entry)
+    ids = set(upserts)
+    with open_data_reader(os.path.join(idx_dir, entry["data_file"]), entry["compression"]) as f:
+        for line in f:
+            if line.strip():
+                key = delta_key(json.loads(line), f"base layer of {os.path.basename(idx_dir)}")
+                if key not in superseded:
+                    ids.add(key)
+    return ids
+
+def source_digest(source):
+    """
+    sha256 of a document's canonical JSON (sorted keys, no whitespace).
+    """
+    canonical = json.dumps(source, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).digest()
+
+def content_hash(digests):
+    """
+    Order-independent hash of a set of documents: the sum of their digests
+    (see source_digest) mod 2^256, so documents read in any order hash the same.
+    """
+    total = 0
+    for digest in digests:
+        total = (total + int.from_bytes(digest, "big")) % (1 << 256)
+    return f"{total:064x}"
+
+def build_index_entry(idx_dir, compression, docs=None):
+    """
+    Describe one exported index for the manifest.
+    """
+    data_name = data_file_name(compression)
+    data_path = os.path.join(idx_dir, data_name)
+    if docs is None:
+        docs = count_docs(data_path, compression)
+    return {
+        "data_file": data_name,
+        "compression": compression,
+        "docs": docs,
+        "bytes": os.path.getsize(data_path),
+        "sha256": file_checksum(data_path),
+        "schema_sha256": file_checksum(os.path.join(idx_dir, SCHEMA_FILE)),
+    }
+
+def load_manifest(repo_dir):
+    """
+    Load manifest.json, or None for a legacy repo without one.
+    """
+    path = os.path.join(repo_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format_version", 0) > FORMAT_VERSION:
+        print(f"❌ Snapshot format {manifest['format_version']} is newer than supported ({FORMAT_VERSION})")
+        sys.exit(1)
+    return manifest
+
+def write_manifest(repo_dir, indices):
+    """
+    Write manifest.json for the given {index: entry} mapping.
+    """
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "indices": {name: indices[name] for name in sorted(indices)},
+    }
+    with open(os.path.join(repo_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+    return manifest
+
+def list_indices(repo_dir):
+    """
+    Return {index: entry} for a repo. Legacy repos get entries without counts
+    or checksums, pointing at the plain data.jsonl.
+    """
+    manifest = load_manifest(repo_dir)
+    if manifest:
+        return manifest["indices"]
+
+    indices = {}
+    for name in sorted(os.listdir(repo_dir)):
+        if os.path.isdir(os.path.join(repo_dir, name)):
+            indices[name] = {"data_file": DATA_FILE, "compression": "none"}
+    return indices
+
+def remove_other_data_files(idx_dir, keep):
+    """
+    Delete data files of other compressions so only one copy remains.
+    """
+    for compression in COMPRESSIONS:
+        name = data_file_name(compression)
+        path = os.path.join(idx_dir, name)
+        if name != keep and os.path.exists(path):
+            os.remove(path)
+
+def remove_deltas(idx_dir):
+    """
+    Delete all delta layers of an index (after a full export rewrote the base).
+    """
+    for name in os.listdir(idx_dir):
+        if name.startswith("delta-"):
+            os.remove(os.path.join(idx_dir, name))
+
+def convert_data_file(idx_dir, src_name, src_compression, compression):
+    """
+    Rewrite an index's data file with another compression.
+    """
+    dst_name = data_file_name(compression)
+    if src_name == dst_name:
+        return
+    dst_tmp = os.path.join(idx_dir, dst_name + ".tmp")
+    with open_data_reader(os.path.join(idx_dir, src_name), src_compression) as src:
+        with open_data_writer(dst_tmp, compression) as dst:
+            for chunk in iter(lambda: src.read(1024 * 1024), b""):
+                dst.write(chunk)
+    os.replace(dst_tmp, os.path.join(idx_dir, dst_name))
+    remove_other_data_files(idx_dir, dst_name)
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the snapshot manifest")
+    parser.add_argument("repo_dir", nargs="?", default=DEFAULT_REPO_DIR)
+    parser.add_argument("--compression", choices=list(COMPRESSIONS),
+                        help="Recompress data files (default: keep the current format)")
+    args = parser.parse_args()
+
+    current = list_indices(args.repo_dir)
+    indices = {}
+    for name, entry in current.items():
+        idx_dir = os.path.join(args.repo_dir, name)
+        compression = args.compression or entry["compression"]
+        convert_data_file(idx_dir, entry["data_file"], entry["compression"], compression)
+        indices[name] = build_index_entry(idx_dir, compression)
+        # Delta layers and high-water mark are not touched by a rebuild
+        for key in ("deltas", "high_water_mark"):
+            if key in entry:
+                indices[name][key] = entry[key]
+        if entry.get("deltas"):
+            indices[name]["base_docs"] = indices[name]["docs"]
+            indices[name]["docs"] = entry["docs"]
+        print(f"   ✅ {name}: {indices[name]['docs']} docs, {indices[name]['bytes']} bytes ({compression})")
+
+    write_manifest(args.repo_dir, indices)
+    print(f"📝 Manifest written: {os.path.join(args.repo_dir, MANIFEST_FILE)}")
+
+if __name__ == "__main__":
+    main()
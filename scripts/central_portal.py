@@ -0,0 +1,332 @@
+"""
+Maven Central Portal API helpers shared by publish_central.py and
+cleanup_central.py.
+
+Deployments are listed page by page and filtered while they are read, and
+drops go out concurrently over one pooled session, paced by a rate limiter
+that also backs off for everyone when the Portal answers 429. What the
+Portal tells us about deployments is kept in a small on-disk cache, so
+repeated runs in a release window do not ask for the same thing again.
+"""
+
+import os
+import json
+import time
+import hashlib
+import fnmatch
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+
+# Overridable so the scripts can run against a local stand-in of the Portal API
+BASE_URL = os.environ.get('CENTRAL_BASE_URL', "https://central.sonatype.com/api/v1/publisher")
+
+# Deployments fetched per /deployments page
+LIST_PAGE_SIZE = int(os.environ.get('LIST_PAGE_SIZE', '100'))
+# Concurrent drops, and the most drop requests started per second
+DROP_WORKERS = int(os.environ.get('DROP_WORKERS', '8'))
+DROP_RATE = float(os.environ.get('DROP_RATE', '20'))
+# Drops answered with 429/5xx or a dropped connection are retried this often
+DROP_RETRIES = 3
+# Published deployments are never dropped, whatever the filters say
+PROTECTED_STATES = ('PUBLISHED',)
+TERMINAL_STATES = ('PUBLISHED', 'FAILED')
+
+# On-disk deployment state cache: terminal states are kept for good, in-flight
+# states and the account listing for DEPLOYMENT_CACHE_TTL seconds (0: not reused)
+DEPLOYMENT_CACHE_DIR = os.environ.get('DEPLOYMENT_CACHE_DIR',
+                                      os.path.join(os.path.expanduser('~'), '.cache', 'central-publisher'))
+DEPLOYMENT_CACHE_TTL = float(os.environ.get('DEPLOYMENT_CACHE_TTL', '60'))
+
+def new_session(headers, pool_size=10):
+    """HTTP session with keep-alive connections reused across all API calls"""
+    session = requests.Session()
+    session.headers.update(headers)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def retry_after(resp):
+    """Seconds requested by a Retry-After header (delta or HTTP date), or None"""
+    value = resp.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class RateLimiter:
+    """Spaces calls at least 1/rate seconds apart across threads (rate <= 0: no limit)"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_at = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            at = max(now, self.next_at)
+            self.next_at = at + self.interval
+        time.sleep(max(0.0, at - now))
+
+    def pause(self, seconds):
+        """Hold back every caller for `seconds` (the Portal asked us to slow down)"""
+        with self.lock:
+            self.next_at = max(self.next_at, time.time() + seconds)
+
+class DeploymentCache:
+    """
+    Deployment states last seen on the Portal, stored as JSON in one file per
+    account. Entries in a TERMINAL_STATES state never change and are served
+    for good; anything else, and the listing of the whole account, is only
+    served for `ttl` seconds and evicted after that.
+    Safe to update from several threads; call save() to write it back.
+    """
+
+    def __init__(self, path, ttl=DEPLOYMENT_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.deployments = {}   # id -> {"data": ..., "fetched_at": ...}
+        self.listing = None     # {"ids": [...], "fetched_at": ...}
+        try:
+            with open(path) as f:
+                stored = json.load(f)
+            self.deployments = stored.get('deployments', {})
+            self.listing = stored.get('listing')
+        except (OSError, ValueError, AttributeError):
+            # No cache yet, or unreadable: start empty
+            pass
+
+    @classmethod
+    def for_account(cls, username, ttl=DEPLOYMENT_CACHE_TTL):
+        """Cache file of one Portal account (the file name does not reveal the user name)"""
+        account = hashlib.sha256(f"{BASE_URL} {username}".encode()).hexdigest()[:16]
+        return cls(os.path.join(DEPLOYMENT_CACHE_DIR, f"deployments-{account}.json"), ttl)
+
+    def fresh(self, entry, now=None):
+        return entry is not None and (now or time.time()) - entry['fetched_at'] < self.ttl
+
+    def get(self, deployment_id):
+        """Cached status of a deployment, or None if it has to be fetched"""
+        with self.lock:
+            entry = self.deployments.get(deployment_id)
+            if entry and (entry['data'].get('deploymentState') in TERMINAL_STATES or self.fresh(entry)):
+                return entry['data']
+        return None
+
+    def put(self, data):
+        """Remember a deployment as the Portal just described it"""
+        deployment_id = data.get('deploymentId')
+        if not deployment_id:
+            return
+        with self.lock:
+            entry = self.deployments.get(deployment_id, {})
+            self.deployments[deployment_id] = {'data': dict(entry.get('data', {}), **data),
+                                               'fetched_at': time.time()}
+            # A deployment created since the account was listed belongs in the listing
+            if self.listing and deployment_id not in self.listing['ids']:
+                self.listing['ids'].append(deployment_id)
+
+    def forget(self, deployment_id):
+        with self.lock:
+            self.deployments.pop(deployment_id, None)
+            if self.listing and deployment_id in self.listing['ids']:
+                self.listing['ids'].remove(deployment_id)
+
+    def clear(self):
+        """Forget everything, terminal states included; what is fetched next is cached again"""
+        with self.lock:
+            self.deployments, self.listing = {}, None
+
+    def listing_age(self):
+        """Seconds since the account was listed, or None if that listing has expired"""
+        with self.lock:
+            return time.time() - self.listing['fetched_at'] if self.fresh(self.listing) else None
+
+    def get_listing(self):
+        """Deployments of the whole account if listed within the TTL, else None"""
+        with self.lock:
+            if not self.fresh(self.listing):
+                return None
+            return [self.deployments[i]['data'] for i in self.listing['ids'] if i in self.deployments]
+
+    def put_listing(self, deployments):
+        now = time.time()
+        with self.lock:
+            for dep in deployments:
+                self.deployments[dep['deploymentId']] = {'data': dep, 'fetched_at': now}
+            self.listing = {'ids': [dep['deploymentId'] for dep in deployments], 'fetched_at': now}
+
+    def save(self):
+        """Evict what has expired and write the cache (atomically, errors are not fatal)"""
+        now = time.time()
+        with self.lock:
+            self.deployments = {i: e for i, e in self.deployments.items()
+                                if e['data'].get('deploymentState') in TERMINAL_STATES or self.fresh(e, now)}
+            if not self.fresh(self.listing, now):
+                self.listing = None
+            stored = {'deployments': self.deployments, 'listing': self.listing}
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp, 'w') as f:
+                    json.dump(stored, f)
+                os.replace(tmp, self.path)
+            except OSError as e:
+                print(f"⚠️ Could not write the deployment cache {self.path}: {e}")
+
+def iter_deployments(session, page_size=LIST_PAGE_SIZE):
+    """
+    Yield deployments from /deployments one page at a time. Copes with a
+    plain list response (the whole account in one go) as well as a paged
+    object ({"deployments": [...], "totalResultCount": N}).
+    Raises requests.HTTPError if the listing fails (404: no list endpoint).
+    """
+    seen = set()
+    page = 0
+    while True:
+        resp = session.get(f"{BASE_URL}/deployments", params={'page': page, 'size': page_size})
+        resp.raise_for_status()
+        body = resp.json()
+        if isinstance(body, dict):
+            items = body.get('deployments') or body.get('items') or []
+            total = body.get('totalResultCount')
+        else:
+            items, total = body, None
+
+        new = [d for d in items if d.get('deploymentId') not in seen]
+        for dep in new:
+            seen.add(dep.get('deploymentId'))
+            yield dep
+
+        # An endpoint that ignores the paging parameters repeats the same page
+        if not new or len(items) < page_size or (total is not None and len(seen) >= total):
+            return
+        page += 1
+
+def cached_deployments(session, cache=None):
+    """
+    Yield the account's deployments: from `cache` while its listing is within
+    the TTL, otherwise from iter_deployments(), remembering the full listing.
+    """
+    listing = cache.get_listing() if cache else None
+    if listing is not None:
+        yield from listing
+        return
+    deployments = []
+    for dep in iter_deployments(session):
+        deployments.append(dep)
+        yield dep
+    if cache:
+        cache.put_listing(deployments)
+
+def deployment_age(dep, now=None):
+    """Seconds since the deployment was created, or None if the Portal did not say"""
+    created = dep.get('createTimestamp')
+    if not created:
+        return None
+    return (now or time.time()) - created / 1000
+
+def parse_age(value):
+    """'90s', '30m', '12h', '2d' (a bare number means hours) -> seconds"""
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    value = value.strip().lower()
+    unit = value[-1] if value[-1:] in units else 'h'
+    try:
+        return float(value.rstrip('smhd')) * units[unit]
+    except ValueError:
+        raise ValueError(f"invalid age: {value!r} (use e.g. 30m, 12h, 2d)")
+
+def matches(dep, states=None, older_than=None, name_pattern=None, now=None):
+    """
+    True if the deployment is in one of `states` (any state if None), was
+    created at least `older_than` seconds ago, and has a name matching the
+    shell-style `name_pattern`
+    """
+    if states and dep.get('deploymentState') not in states:
+        return False
+    if older_than is not None:
+        age = deployment_age(dep, now)
+        if age is None or age < older_than:
+            return False
+    if name_pattern and not fnmatch.fnmatch(dep.get('deploymentName') or '', name_pattern):
+        return False
+    return True
+
+def select_deployments(deployments, states=None, older_than=None, name_pattern=None):
+    """
+    Yield the deployments to drop: those that match() the filters, except
+    PROTECTED_STATES which are always skipped.
+    """
+    now = time.time()
+    for dep in deployments:
+        if dep.get('deploymentState') not in PROTECTED_STATES and \
+                matches(dep, states, older_than, name_pattern, now):
+            yield dep
+
+def drop_one(session, deployment_id, limiter=None, retries=DROP_RETRIES):
+    """
+    DELETE one deployment. Returns (ok, detail). A deployment that is already
+    gone (404) counts as dropped.
+    """
+    url = f"{BASE_URL}/deployment/{deployment_id}"
+    detail = ''
+    for attempt in range(retries + 1):
+        if limiter:
+            limiter.wait()
+        try:
+            resp = session.delete(url)
+        except requests.RequestException as e:
+            detail = str(e)
+            if attempt < retries:
+                time.sleep(min(2 ** attempt, 10))
+            continue
+        if resp.status_code in (200, 204):
+            return True, 'dropped'
+        if resp.status_code == 404:
+            return True, 'already gone'
+        detail = f"{resp.status_code} {resp.text.strip()}"
+        if (resp.status_code != 429 and resp.status_code < 500) or attempt >= retries:
+            break
+        delay = retry_after(resp) or min(2 ** attempt, 10)
+        if limiter:
+            limiter.pause(delay)
+        else:
+            time.sleep(delay)
+    return False, detail
+
+def drop_deployments(session, deployments, workers=DROP_WORKERS, rate=DROP_RATE, on_result=None,
+                     cache=None):
+    """
+    Drop `deployments` concurrently, at most `rate` requests per second.
+    `on_result(dep, ok, detail)` is called as each drop finishes; dropped
+    deployments are removed from `cache`.
+    Returns the list of deployments that could not be dropped.
+    """
+    limiter = RateLimiter(rate)
+    failed = []
+    lock = threading.Lock()
+
+    def drop(dep):
+        ok, detail = drop_one(session, dep.get('deploymentId'), limiter)
+        if ok and cache:
+            cache.forget(dep.get('deploymentId'))
+        with lock:
+            if not ok:
+                failed.append(dep)
+            if on_result:
+                on_result(dep, ok, detail)
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        list(pool.map(drop, deployments))
+    return failed
@@ -7,16 +7,26 @@ Lists all deployments and optionally cleans up failed/stuck ones.
 Usage:
   # List all deployments
   python3 cleanup_central.py --list
-  
-  # Clean up specific deployment
-  python3 cleanup_central.py --drop DEPLOYMENT_ID
-  
+
+  # Clean up specific deployment(s)
+  python3 cleanup_central.py --drop DEPLOYMENT_ID [DEPLOYMENT_ID ...]
+
   # Clean up all FAILED deployments
   python3 cleanup_central.py --clean-failed
-  
+
   # Clean up all non-PUBLISHED deployments (FAILED + VALIDATING + PUBLISHING)
   python3 cleanup_central.py --clean-all
 
+  # Show what would be dropped: VALIDATING deployments older than 2 hours
+  python3 cleanup_central.py --clean-all --state VALIDATING --older-than 2h --dry-run
+
+Filters (--state, --older-than, --name) narrow --list, --clean-failed and
+--clean-all. Drops run concurrently (--workers) and are rate limited (--rate).
+
+--list and --status answer from the local deployment cache while it is fresh
+(DEPLOYMENT_CACHE_TTL seconds; FAILED and PUBLISHED states are kept for good).
+--refresh asks the Portal anyway. The clean commands always list afresh.
+
 Environment variables:
   OSSRH_USERNAME - Maven Central username
   OSSRH_PASSWORD - Maven Central password (or token)
@@ -24,177 +34,225 @@ Environment variables:
 
 import os
 import sys
+import time
 import requests
 import json
 import argparse
-from datetime import datetime
-
-BASE_URL = "https://central.sonatype.com/api/v1/publisher"
+from central_portal import (BASE_URL, DROP_WORKERS, DROP_RATE, DeploymentCache,
+                            new_session, iter_deployments, cached_deployments, matches, select_deployments,
+                            deployment_age, parse_age, drop_one, drop_deployments)
 
 def get_auth_header():
     """Get authorization header from environment"""
     username = os.environ.get('OSSRH_USERNAME')
     password = os.environ.get('OSSRH_PASSWORD')
-    
+
     if not username or not password:
         print("❌ Error: OSSRH_USERNAME and OSSRH_PASSWORD must be set")
         sys.exit(1)
-    
+
     import base64
     creds = base64.b64encode(f"{username}:{password}".encode()).decode()
     return {'Authorization': f'UserToken {creds}'}
 
-def list_deployments():
-    """List all deployments"""
-    headers = get_auth_header()
-    
-    # Note: Maven Central API might not have a list endpoint
-    # We'll try the status endpoint without ID to see if it lists all
-    url = f"{BASE_URL}/deployments"
-    
-    print(f"📋 Fetching deployments from Maven Central...")
-    print(f"🔗 {url}")
-    
+def state_display(state):
+    """Color code by state"""
+    if state == 'PUBLISHED':
+        return f"\033[32m{state}\033[0m"  # Green
+    elif state == 'FAILED':
+        return f"\033[31m{state}\033[0m"  # Red
+    elif state == 'PUBLISHING':
+        return f"\033[33m{state}\033[0m"  # Yellow
+    return state
+
+def format_age(seconds):
+    if seconds is None:
+        return '-'
+    for unit, size in (('d', 86400), ('h', 3600), ('m', 60)):
+        if seconds >= size:
+            return f"{seconds / size:.1f}{unit}"
+    return f"{seconds:.0f}s"
+
+def print_header():
+    print(f"{'ID':<40} {'State':<15} {'Age':>7}  {'Name':<30}")
+    print("=" * 98)
+
+def print_deployment(dep):
+    dep_id = dep.get('deploymentId', 'unknown')
+    state = dep.get('deploymentState', 'unknown')
+    name = dep.get('deploymentName', 'unknown')
+    # Pad before coloring: the escape codes would throw the width off
+    print(f"{dep_id:<40} {state_display(f'{state:<15}')} {format_age(deployment_age(dep)):>7}  {name:<30}")
+
+def print_list_error(e):
+    """Explain why /deployments could not be listed"""
+    if isinstance(e, requests.HTTPError) and e.response.status_code == 404:
+        print("\n⚠️  List endpoint not available")
+        print("💡 You can only drop deployments if you have the deployment ID")
+        print("   Check your CI logs for deployment IDs from failed runs")
+    elif isinstance(e, requests.HTTPError):
+        print(f"\n❌ Error: {e.response.status_code}")
+        print(e.response.text)
+    else:
+        print(f"\n❌ Exception: {e}")
+
+def list_deployments(session, cache, states=None, older_than=None, name_pattern=None):
+    """List all deployments, printing the rows as the pages arrive"""
+    age = cache.listing_age()
+    if age is not None:
+        print(f"📋 Deployments as listed {age:.0f}s ago (cached, --refresh to fetch)\n")
+    else:
+        url = f"{BASE_URL}/deployments"
+        print(f"📋 Fetching deployments from Maven Central...")
+        print(f"🔗 {url}\n")
+
+    deployments = []
     try:
-        resp = requests.get(url, headers=headers)
-        
-        if resp.status_code == 200:
-            deployments = resp.json()
-            
+        for dep in cached_deployments(session, cache):
+            if not matches(dep, states, older_than, name_pattern):
+                continue
             if not deployments:
-                print("\n✅ No deployments found")
-                return []
-            
-            print(f"\n📦 Found {len(deployments)} deployment(s):\n")
-            print(f"{'ID':<40} {'State':<15} {'Name':<30}")
-            print("=" * 90)
-            
-            for dep in deployments:
-                dep_id = dep.get('deploymentId', 'unknown')
-                state = dep.get('deploymentState', 'unknown')
-                name = dep.get('deploymentName', 'unknown')
-                
-                # Color code by state
-                if state == 'PUBLISHED':
-                    state_display = f"\033[32m{state}\033[0m"  # Green
-                elif state == 'FAILED':
-                    state_display = f"\033[31m{state}\033[0m"  # Red
-                elif state == 'PUBLISHING':
-                    state_display = f"\033[33m{state}\033[0m"  # Yellow
-                else:
-                    state_display = state
-                
-                print(f"{dep_id:<40} {state_display:<24} {name:<30}")
-            
-            return deployments
-        
-        elif resp.status_code == 404:
-            print("\n⚠️  List endpoint not available")
-            print("💡 You can only drop deployments if you have the deployment ID")
-            print("   Check your CI logs for deployment IDs from failed runs")
-            return None
-        
-        else:
-            print(f"\n❌ Error: {resp.status_code}")
-            print(resp.text)
-            return None
-    
+                print_header()
+            deployments.append(dep)
+            print_deployment(dep)
     except Exception as e:
-        print(f"\n❌ Exception: {e}")
+        print_list_error(e)
         return None
 
-def get_deployment_status(deployment_id):
+    if not deployments:
+        print("✅ No deployments found")
+    else:
+        print(f"\n📦 Found {len(deployments)} deployment(s)")
+    return deployments
+
+def plan_cleanup(session, cache, states=None, older_than=None, name_pattern=None):
+    """
+    Deployments to drop. Always listed afresh (a cached in-flight state may
+    be out of date), and the listing refreshes the cache. The whole plan is
+    collected before anything is dropped: dropping while paging would shift
+    the pages under the listing.
+    Returns None if the deployments could not be listed.
+    """
+    print(f"📋 Fetching deployments from Maven Central...")
+    print(f"🔗 {BASE_URL}/deployments")
+    try:
+        deployments = list(iter_deployments(session))
+    except Exception as e:
+        print_list_error(e)
+        return None
+    cache.put_listing(deployments)
+    return list(select_deployments(deployments, states, older_than, name_pattern))
+
+def get_deployment_status(session, cache, deployment_id):
     """Get status of a specific deployment"""
-    headers = get_auth_header()
+    status = cache.get(deployment_id)
+    if status is not None:
+        print("💾 From the local deployment cache (--refresh to ask Maven Central)")
+        return status
+
     url = f"{BASE_URL}/status?id={deployment_id}"
-    
+
     try:
-        resp = requests.post(url, headers=headers, json={"deploymentId": deployment_id})
-        
+        resp = session.post(url, json={"deploymentId": deployment_id})
+
         if resp.status_code == 200:
-            return resp.json()
+            status = resp.json()
+            cache.put(dict(status, deploymentId=deployment_id))
+            return status
         else:
             print(f"❌ Error getting status: {resp.status_code}")
             return None
-    
+
     except Exception as e:
         print(f"❌ Exception: {e}")
         return None
 
-def drop_deployment(deployment_id):
+def drop_deployment(session, cache, deployment_id):
     """Drop (delete) a deployment"""
-    headers = get_auth_header()
     url = f"{BASE_URL}/deployment/{deployment_id}"
-    
+
     print(f"\n🗑️  Dropping deployment: {deployment_id}")
     print(f"🔗 [DELETE] {url}")
-    
-    try:
-        resp = requests.delete(url, headers=headers)
-        
-        if resp.status_code in [200, 204]:
-            print("✅ Dropped successfully")
-            return True
-        else:
-            print(f"❌ Drop failed: {resp.status_code}")
-            print(resp.text)
+
+    ok, detail = drop_one(session, deployment_id)
+    if ok:
+        cache.forget(deployment_id)
+        print(f"✅ Dropped successfully ({detail})")
+    else:
+        print(f"❌ Drop failed: {detail}")
+    return ok
+
+def clean(session, cache, plan, dry_run=False, confirm=False, workers=DROP_WORKERS, rate=DROP_RATE):
+    """
+    Drop the deployments in `plan` concurrently. With dry_run the plan is
+    only printed; with confirm the user has to type 'yes' first.
+    Returns True if every drop succeeded.
+    """
+    print_header()
+    for dep in plan:
+        print_deployment(dep)
+
+    if dry_run:
+        print(f"\n📝 Dry run: {len(plan)} deployment(s) would be dropped")
+        return True
+
+    if confirm:
+        answer = input("\nType 'yes' to confirm: ")
+        if answer.lower() != 'yes':
+            print("❌ Cancelled")
             return False
-    
-    except Exception as e:
-        print(f"❌ Exception: {e}")
-        return False
 
-def clean_failed():
+    print(f"\n🗑️  Dropping {len(plan)} deployment(s) ({workers} at a time, up to {rate:g}/s)...")
+    started = time.time()
+
+    def dropped(dep, ok, detail):
+        mark = "✅" if ok else "❌"
+        print(f"  {mark} {dep.get('deploymentName') or '-'} ({dep.get('deploymentId', '')[:8]}...): {detail}")
+
+    failed = drop_deployments(session, plan, workers=workers, rate=rate, on_result=dropped, cache=cache)
+    print(f"\n🧹 Dropped {len(plan) - len(failed)}/{len(plan)} deployment(s) in {time.time() - started:.1f}s")
+    return not failed
+
+def clean_failed(session, cache, older_than=None, name_pattern=None, **options):
     """Clean up all FAILED deployments"""
-    deployments = list_deployments()
-    
-    if not deployments:
-        return
-    
-    failed = [d for d in deployments if d.get('deploymentState') == 'FAILED']
-    
+    failed = plan_cleanup(session, cache, ['FAILED'], older_than, name_pattern)
+
+    if failed is None:
+        return False
+
     if not failed:
         print("\n✅ No FAILED deployments to clean")
-        return
-    
-    print(f"\n🧹 Found {len(failed)} FAILED deployment(s)")
-    
-    for dep in failed:
-        dep_id = dep.get('deploymentId')
-        name = dep.get('deploymentName')
-        print(f"\n  • {name} ({dep_id[:8]}...)")
-        drop_deployment(dep_id)
-
-def clean_all():
+        return True
+
+    print(f"\n🧹 Found {len(failed)} FAILED deployment(s)\n")
+    return clean(session, cache, failed, **options)
+
+def clean_all(session, cache, states=None, older_than=None, name_pattern=None, yes=False, **options):
     """Clean up all non-PUBLISHED deployments"""
-    deployments = list_deployments()
-    
-    if not deployments:
-        return
-    
-    to_clean = [d for d in deployments if d.get('deploymentState') != 'PUBLISHED']
-    
+    to_clean = plan_cleanup(session, cache, states, older_than, name_pattern)
+
+    if to_clean is None:
+        return False
+
     if not to_clean:
         print("\n✅ No deployments to clean")
-        return
-    
+        return True
+
     print(f"\n🧹 Found {len(to_clean)} deployment(s) to clean")
-    print("\n⚠️  WARNING: This will drop ALL non-published deployments including:")
-    print("   - FAILED")
-    print("   - VALIDATING") 
-    print("   - PUBLISHING")
-    
-    confirm = input("\nType 'yes' to confirm: ")
-    if confirm.lower() != 'yes':
-        print("❌ Cancelled")
-        return
-    
-    for dep in to_clean:
-        dep_id = dep.get('deploymentId')
-        name = dep.get('deploymentName')
-        state = dep.get('deploymentState')
-        print(f"\n  • {name} ({state}) - {dep_id[:8]}...")
-        drop_deployment(dep_id)
+    if not states:
+        print("\n⚠️  WARNING: This will drop ALL non-published deployments including:")
+        print("   - FAILED")
+        print("   - VALIDATING")
+        print("   - PUBLISHING")
+    print()
+
+    return clean(session, cache, to_clean, confirm=not yes, **options)
+
+def age_arg(value):
+    try:
+        return parse_age(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
 
 def main():
     parser = argparse.ArgumentParser(
@@ -202,40 +260,77 @@ def main():
         formatter_class=argparse.RawDescriptionHelpFormatter,
         epilog=__doc__
     )
-    
+
     parser.add_argument('--list', action='store_true',
                        help='List all deployments')
-    parser.add_argument('--drop', metavar='ID',
-                       help='Drop a specific deployment by ID')
+    parser.add_argument('--drop', metavar='ID', nargs='+',
+                       help='Drop specific deployment(s) by ID')
     parser.add_argument('--status', metavar='ID',
                        help='Get status of a specific deployment')
     parser.add_argument('--clean-failed', action='store_true',
                        help='Clean up all FAILED deployments')
     parser.add_argument('--clean-all', action='store_true',
                        help='Clean up all non-PUBLISHED deployments (interactive)')
-    
+
+    filters = parser.add_argument_group('filters')
+    filters.add_argument('--state', action='append', metavar='STATE',
+                        help='Only deployments in this state (repeatable)')
+    filters.add_argument('--older-than', type=age_arg, metavar='AGE',
+                        help='Only deployments created at least AGE ago (30m, 12h, 2d)')
+    filters.add_argument('--name', metavar='PATTERN',
+                        help='Only deployments whose name matches this shell pattern')
+
+    filters.add_argument('--refresh', action='store_true',
+                        help='Ask Maven Central even if the local deployment cache is fresh')
+
+    cleaning = parser.add_argument_group('cleaning')
+    cleaning.add_argument('--dry-run', action='store_true',
+                         help='Print what would be dropped without dropping it')
+    cleaning.add_argument('--yes', action='store_true',
+                         help='Do not ask for confirmation in --clean-all')
+    cleaning.add_argument('--workers', type=int, default=DROP_WORKERS,
+                         help='Deployments dropped concurrently')
+    cleaning.add_argument('--rate', type=float, default=DROP_RATE,
+                         help='Most drop requests per second (0: unlimited)')
+
     args = parser.parse_args()
-    
+    states = [s.upper() for s in args.state] if args.state else None
+    options = {'dry_run': args.dry_run, 'workers': max(args.workers, 1), 'rate': args.rate}
+
+    if not any([args.list, args.drop, args.status, args.clean_failed, args.clean_all]):
+        parser.print_help()
+        return
+
+    session = new_session(get_auth_header(), pool_size=max(args.workers, 1) + 2)
+    cache = DeploymentCache.for_account(os.environ['OSSRH_USERNAME'])
+    if args.refresh:
+        cache.clear()
+    ok = True
+
     if args.list:
-        list_deployments()
-    
+        ok = list_deployments(session, cache, states, args.older_than, args.name) is not None
+
     elif args.drop:
-        drop_deployment(args.drop)
-    
+        if len(args.drop) == 1:
+            ok = drop_deployment(session, cache, args.drop[0])
+        else:
+            ok = clean(session, cache, [{'deploymentId': dep_id} for dep_id in args.drop], **options)
+
     elif args.status:
-        status = get_deployment_status(args.status)
+        status = get_deployment_status(session, cache, args.status)
         if status:
             print("\n📊 Deployment Status:")
             print(json.dumps(status, indent=2))
-    
+        ok = status is not None
+
     elif args.clean_failed:
-        clean_failed()
-    
+        ok = clean_failed(session, cache, args.older_than, args.name, **options)
+
     elif args.clean_all:
-        clean_all()
-    
-    else:
-        parser.print_help()
+        ok = clean_all(session, cache, states, args.older_than, args.name, yes=args.yes, **options)
+
+    cache.save()
+    sys.exit(0 if ok else 1)
 
 if __name__ == "__main__":
     main()
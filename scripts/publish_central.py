@@ -4,11 +4,40 @@ import time
 import base64
 import requests
 import json
+import glob
+import uuid
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from central_portal import (BASE_URL, DROP_WORKERS, TERMINAL_STATES, DeploymentCache, new_session,
+                            retry_after, iter_deployments, cached_deployments, select_deployments,
+                            drop_deployments)
 
 # ================= Config =================
-BASE_URL = "https://central.sonatype.com/api/v1/publisher"
 DEBUG = os.environ.get('DEBUG', 'false').lower() == 'true'
 
+# Status polling: fast while the bundle is validated, then exponential backoff
+POLL_INITIAL_INTERVAL = float(os.environ.get('POLL_INITIAL_INTERVAL', '2'))
+POLL_MAX_INTERVAL = float(os.environ.get('POLL_MAX_INTERVAL', '30'))
+POLL_BACKOFF = 1.5
+POLL_TIMEOUT = int(os.environ.get('POLL_TIMEOUT', '1200'))  # 20 minutes
+# A deployment that has been PUBLISHING this long passed validation and is
+# only being synced to Maven Central (10-30 minutes); count it as success
+PUBLISHING_GRACE = float(os.environ.get('PUBLISHING_GRACE', '300'))
+MAX_CONSECUTIVE_ERRORS = 5
+# Bundles uploaded at the same time in batch mode
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', '4'))
+# Upload streaming: the bundle is read in chunks of this size, never loaded whole
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Transient upload failures (dropped connection, 429, 5xx) are retried with backoff
+UPLOAD_RETRIES = int(os.environ.get('UPLOAD_RETRIES', '3'))
+UPLOAD_BACKOFF = 5.0
+UPLOAD_TIMEOUT = (10, 300)  # connect, per-read seconds
+PROGRESS_INTERVAL = 5.0
+# Margin for the clock difference between this host and the Portal when
+# matching a deployment created by an interrupted upload
+CLOCK_SKEW_MARGIN = 300
+
 # Force unbuffered output for CI
 sys.stdout.reconfigure(line_buffering=True)
 
@@ -18,190 +47,455 @@ def debug_log(msg):
 
 def safe_headers(headers):
     """Return headers with masked sensitive info"""
-    safe = headers.copy()
+    safe = dict(headers)
     if 'Authorization' in safe:
         safe['Authorization'] = 'UserToken ******'
     return safe
 
-def drop_deployment(deployment_id, headers):
-    if not deployment_id: 
-        return
+class DeploymentPoller:
+    """
+    Polls /status for any number of deployments until each one settles.
+
+    Each deployment is polled on its own schedule: every POLL_INITIAL_INTERVAL
+    at first, growing by POLL_BACKOFF up to POLL_MAX_INTERVAL while the state
+    stays the same, and back to the initial interval when it changes. A
+    Retry-After header from the server takes precedence.
+    Every state change is recorded with its time in `timeline`, and every
+    status received is remembered in `cache` (a DeploymentCache), if given.
+
+    run() returns {deployment_id: outcome}, where outcome is PUBLISHED,
+    PUBLISHING (accepted after PUBLISHING_GRACE), FAILED, TIMEOUT or ERROR.
+    """
+
+    def __init__(self, session, deployment_ids, timeout=POLL_TIMEOUT, publishing_grace=PUBLISHING_GRACE,
+                 cache=None):
+        self.session = session
+        self.cache = cache
+        self.timeout = timeout
+        self.publishing_grace = publishing_grace
+        now = time.time()
+        self.start = {dep_id: now for dep_id in deployment_ids}
+        self.next_poll = {dep_id: now + POLL_INITIAL_INTERVAL for dep_id in deployment_ids}
+        self.interval = {dep_id: POLL_INITIAL_INTERVAL for dep_id in deployment_ids}
+        self.errors = {dep_id: 0 for dep_id in deployment_ids}
+        self.state = {dep_id: None for dep_id in deployment_ids}
+        self.data = {dep_id: {} for dep_id in deployment_ids}
+        self.timeline = {dep_id: [] for dep_id in deployment_ids}
+        self.outcome = {}
+        self.finished = {}
+
+    def record(self, dep_id, state):
+        """Append a state change to the timeline"""
+        self.state[dep_id] = state
+        self.timeline[dep_id].append((time.time(), state))
+        label = f" [{dep_id[:8]}]" if len(self.start) > 1 else ""
+        print(f"   Status{label}: {state} (+{time.time() - self.start[dep_id]:.1f}s)")
+
+    def poll(self, dep_id):
+        """Query one deployment and schedule its next poll"""
+        url = f"{BASE_URL}/status?id={dep_id}"
+        wait = None
+        try:
+            resp = self.session.post(url, json={"deploymentId": dep_id})
+            debug_log(f"Check Status ({dep_id[:8]}): {resp.status_code} {resp.text}")
+            wait = retry_after(resp)
+
+            if resp.status_code == 200:
+                self.errors[dep_id] = 0
+                self.data[dep_id] = resp.json()
+                if self.cache:
+                    self.cache.put(dict(self.data[dep_id], deploymentId=dep_id))
+                state = self.data[dep_id].get('deploymentState', 'UNKNOWN')
+                if state != self.state[dep_id]:
+                    self.record(dep_id, state)
+                    self.interval[dep_id] = POLL_INITIAL_INTERVAL
+                else:
+                    self.interval[dep_id] = min(POLL_MAX_INTERVAL, self.interval[dep_id] * POLL_BACKOFF)
+            else:
+                self.errors[dep_id] += 1
+                print(f"   ⚠️ HTTP {resp.status_code}: {resp.text}")
+        except Exception as e:
+            self.errors[dep_id] += 1
+            print(f"   ⚠️ Exception: {e}")
+
+        if self.errors[dep_id]:
+            self.interval[dep_id] = min(POLL_MAX_INTERVAL, self.interval[dep_id] * POLL_BACKOFF)
+        self.next_poll[dep_id] = time.time() + (wait if wait is not None else self.interval[dep_id])
+
+    def settle(self, dep_id):
+        """Decide whether a deployment is done. Returns its outcome or None"""
+        state = self.state[dep_id]
+        elapsed = time.time() - self.start[dep_id]
+        if state in TERMINAL_STATES:
+            return state
+        if state == 'PUBLISHING' and elapsed > self.publishing_grace:
+            return 'PUBLISHING'
+        if self.errors[dep_id] >= MAX_CONSECUTIVE_ERRORS:
+            return 'ERROR'
+        if elapsed > self.timeout:
+            return 'TIMEOUT'
+        return None
+
+    def run(self):
+        """Poll until every deployment has an outcome"""
+        while len(self.outcome) < len(self.start):
+            pending = [dep_id for dep_id in self.start if dep_id not in self.outcome]
+            dep_id = min(pending, key=self.next_poll.get)
+            time.sleep(max(0.0, self.next_poll[dep_id] - time.time()))
+            self.poll(dep_id)
+            outcome = self.settle(dep_id)
+            if outcome:
+                self.outcome[dep_id] = outcome
+                self.finished[dep_id] = time.time()
+        return self.outcome
+
+    def print_timeline(self, dep_id):
+        print(f"\n🕒 Timeline ({dep_id}):")
+        for at, state in self.timeline[dep_id]:
+            print(f"   +{at - self.start[dep_id]:7.1f}s  {state}")
+        end = self.finished.get(dep_id, time.time())
+        print(f"   {self.outcome.get(dep_id, 'PENDING')} after {end - self.start[dep_id]:.1f}s")
+
+def drop_deployment(deployment_id, session):
+    """Drop one deployment. Returns True if it is gone"""
+    if not deployment_id:
+        return False
     url = f"{BASE_URL}/deployment/{deployment_id}"
     print(f"\n🗑️  [DELETE] {url}")
-    
+
     if DEBUG:
-        debug_log(f"Headers: {safe_headers(headers)}")
+        debug_log(f"Headers: {safe_headers(session.headers)}")
 
     try:
-        resp = requests.delete(url, headers=headers)
+        resp = session.delete(url)
         if DEBUG:
             debug_log(f"Response ({resp.status_code}): {resp.text}")
 
         if resp.status_code in [200, 204]:
             print("✅ Dropped successfully.")
-        else:
-            print(f"⚠️ Drop failed: {resp.status_code} {resp.text}")
+            return True
+        print(f"⚠️ Drop failed: {resp.status_code} {resp.text}")
     except Exception as e:
         print(f"⚠️ Drop error: {e}")
+    return False
 
-def cleanup_failed_deployments(headers):
-    """Clean up any FAILED deployments before starting new upload"""
+def cleanup_failed_deployments(session, cache=None):
+    """
+    Clean up any FAILED deployments before starting new upload. A listing
+    still in `cache` is good enough: FAILED is terminal, so a cached FAILED
+    deployment is either still there or already gone.
+    """
     print("\n🧹 Checking for failed deployments to clean up...")
-    
-    # Try to list deployments (may not be available in API)
-    list_url = f"{BASE_URL}/deployments"
-    
+
     try:
-        resp = requests.get(list_url, headers=headers)
-        
-        if resp.status_code == 200:
-            deployments = resp.json()
-            failed = [d for d in deployments if d.get('deploymentState') == 'FAILED']
-            
-            if not failed:
-                print("✅ No failed deployments found")
-                return
-            
-            print(f"📦 Found {len(failed)} FAILED deployment(s)")
-            
-            for dep in failed:
-                dep_id = dep.get('deploymentId')
-                name = dep.get('deploymentName', 'unknown')
-                print(f"   🗑️  Dropping: {name} ({dep_id[:8]}...)")
-                drop_deployment(dep_id, headers)
-        
-        elif resp.status_code == 404:
-            # List endpoint not available, that's OK
-            if DEBUG:
-                debug_log("List endpoint not available - skipping cleanup")
-            pass
-        
-        else:
-            if DEBUG:
-                debug_log(f"List returned {resp.status_code} - skipping cleanup")
-    
+        # Collect the whole plan first: dropping while paging would shift the pages
+        failed = list(select_deployments(cached_deployments(session, cache), states=('FAILED',)))
+    except requests.HTTPError as e:
+        # List endpoint not available (404) or refused, that's OK
+        debug_log(f"List returned {e.response.status_code} - skipping cleanup")
+        return
     except Exception as e:
-        if DEBUG:
-            debug_log(f"Cleanup check failed: {e}")
         # Don't fail the whole publish if cleanup fails
-        pass
+        debug_log(f"Cleanup check failed: {e}")
+        return
 
-def main():
-    username = os.environ.get('OSSRH_USERNAME')
-    password = os.environ.get('OSSRH_PASSWORD')
-    zip_path = os.environ.get('ZIP_FILE_PATH')
+    if not failed:
+        print("✅ No failed deployments found")
+        return
 
-    if not all([username, password, zip_path]):
-        print("Error: Missing env vars (OSSRH_USERNAME, OSSRH_PASSWORD, ZIP_FILE_PATH)")
-        sys.exit(1)
+    print(f"📦 Found {len(failed)} FAILED deployment(s)")
 
-    auth_str = f"{username}:{password}"
-    b64_auth = base64.b64encode(auth_str.encode()).decode()
-    headers = {"Authorization": f"UserToken {b64_auth}"}
+    def dropped(dep, ok, detail):
+        name = dep.get('deploymentName', 'unknown')
+        mark = "🗑️ " if ok else "⚠️"
+        print(f"   {mark} {name} ({dep.get('deploymentId', '')[:8]}...): {detail}")
 
-    # ================= 0. Cleanup =================
-    cleanup_failed_deployments(headers)
-    
-    print("\n" + "="*50)
+    drop_deployments(session, failed, on_result=dropped, cache=cache)
 
-    # ================= 1. Upload =================
+def file_sha256(path):
+    """sha256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def format_size(num):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if num < 1024 or unit == 'GB':
+            return f"{num:.1f} {unit}" if unit != 'B' else f"{num} B"
+        num /= 1024
+
+class MultipartStream:
+    """
+    multipart/form-data body for one file, produced while it is sent: the
+    file is read in UPLOAD_CHUNK_SIZE pieces, so memory use does not depend on
+    the bundle size. Reports progress (throughput, ETA) every PROGRESS_INTERVAL
+    and hashes the file bytes as they go out.
+    """
+
+    def __init__(self, path, field, fields=None):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.boundary = uuid.uuid4().hex
+        head = b''
+        for key, value in (fields or {}).items():
+            head += (f'--{self.boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n'
+                     f'{value}\r\n').encode()
+        head += (f'--{self.boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{self.name}"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n').encode()
+        self.head = head
+        self.tail = f'\r\n--{self.boundary}--\r\n'.encode()
+        self.file_size = os.path.getsize(path)
+        self.length = len(self.head) + self.file_size + len(self.tail)
+        self.content_type = f'multipart/form-data; boundary={self.boundary}'
+        self.sent = 0
+        self.digest = hashlib.sha256()
+        self.file = open(path, 'rb')
+        self.pending = self.head
+        self.started = self.reported = time.time()
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = UPLOAD_CHUNK_SIZE
+        if not self.pending:
+            chunk = self.file.read(min(size, UPLOAD_CHUNK_SIZE))
+            if chunk:
+                self.digest.update(chunk)
+                self.pending = chunk
+            elif self.tail:
+                self.pending, self.tail = self.tail, b''
+        data, self.pending = self.pending[:size], self.pending[size:]
+        self.sent += len(data)
+        if time.time() - self.reported >= PROGRESS_INTERVAL or (data and self.sent == self.length):
+            self.report()
+        return data
+
+    def report(self):
+        self.reported = time.time()
+        elapsed = max(self.reported - self.started, 1e-6)
+        rate = self.sent / elapsed
+        eta = (self.length - self.sent) / rate if rate else 0
+        print(f"   ⬆️  {self.name}: {format_size(self.sent)}/{format_size(self.length)} "
+              f"({self.sent * 100 // max(self.length, 1)}%) {format_size(rate)}/s, ETA {eta:.0f}s")
+
+    def close(self):
+        self.file.close()
+
+def find_deployment(session, name, since):
+    """
+    ID of a deployment created after `since` (local epoch seconds, less
+    CLOCK_SKEW_MARGIN for the Portal's clock), if any. `name` must be the
+    exact deployment name the upload sent (see deployment_names()).
+    """
+    try:
+        for dep in iter_deployments(session):
+            created = (dep.get('createTimestamp') or 0) / 1000
+            if dep.get('deploymentName') == name and created >= since - CLOCK_SKEW_MARGIN:
+                return dep.get('deploymentId')
+    except requests.RequestException as e:
+        debug_log(f"Deployment lookup failed: {e}")
+    return None
+
+def deployment_names(bundles):
+    """
+    {zip_path: deployment name} for a batch: the bundle's file name, with a
+    short hash of its absolute path added when several bundles share that
+    file name, so that each name identifies one upload
+    """
+    basenames = [os.path.basename(path) for path in bundles]
+    names = {}
+    for path, base in zip(bundles, basenames):
+        if basenames.count(base) > 1:
+            stem, ext = os.path.splitext(base)
+            base = f"{stem}-{hashlib.sha256(os.path.abspath(path).encode()).hexdigest()[:8]}{ext}"
+        names[path] = base
+    return names
+
+def upload_bundle(session, zip_path, name=None):
+    """
+    Upload one bundle, streaming it from disk, as a deployment called `name`
+    (default: the file name). Transient failures are retried with backoff;
+    before each retry the bundle checksum is verified (a changed file is not
+    re-sent) and the Portal is checked for a deployment of that exact name
+    the interrupted attempt may already have created.
+    Returns the deployment ID, or None if the upload failed.
+    """
+    name = name or os.path.basename(zip_path)
     upload_url = f"{BASE_URL}/upload"
-    print(f"📤 Uploading bundle to Maven Central Portal")
+    checksum = file_sha256(zip_path)
     print(f"🚀 [POST] {upload_url}")
-    print(f"   File: {os.path.basename(zip_path)}")
-    
+    print(f"   File: {name} ({format_size(os.path.getsize(zip_path))}, sha256 {checksum[:16]}...)")
+
     if DEBUG:
-        debug_log(f"Headers: {safe_headers(headers)}")
+        debug_log(f"Headers: {safe_headers(session.headers)}")
         debug_log("Payload: publishingType=AUTOMATIC")
 
-    try:
-        with open(zip_path, 'rb') as f:
-            resp = requests.post(upload_url, headers=headers, 
-                               files={'bundle': f}, 
-                               data={'publishingType': 'AUTOMATIC'})
-        
+    for attempt in range(UPLOAD_RETRIES + 1):
+        if attempt:
+            delay = UPLOAD_BACKOFF * (2 ** (attempt - 1))
+            print(f"   🔁 Retrying {name} in {delay:.0f}s (attempt {attempt + 1}/{UPLOAD_RETRIES + 1})")
+            time.sleep(delay)
+            if file_sha256(zip_path) != checksum:
+                print(f"❌ Upload Error ({name}): bundle changed on disk since the first attempt")
+                return None
+            deployment_id = find_deployment(session, name, attempt_start)
+            if deployment_id:
+                print(f"✅ Interrupted upload of {name} was received. ID: {deployment_id}")
+                return deployment_id
+
+        attempt_start = time.time()
+        body = MultipartStream(zip_path, 'bundle', {'publishingType': 'AUTOMATIC'})
+        try:
+            resp = session.post(upload_url, params={'name': name}, data=body, timeout=UPLOAD_TIMEOUT,
+                                headers={'Content-Type': body.content_type})
+        except (requests.ConnectionError, requests.Timeout) as e:
+            print(f"   ⚠️ Upload interrupted ({name}) after {format_size(body.sent)}: {e}")
+            continue
+        except Exception as e:
+            print(f"❌ Upload Error ({name}): {e}")
+            return None
+        finally:
+            body.close()
+
         if DEBUG:
             debug_log(f"Response Status: {resp.status_code}")
             debug_log(f"Response Body: {resp.text}")
 
-        if resp.status_code != 201:
-            print(f"❌ Upload Failed: {resp.status_code} - {resp.text}")
-            sys.exit(1)
-            
-        deployment_id = resp.text.strip().replace('"', '')
-        print(f"✅ Uploaded. ID: {deployment_id}")
+        if resp.status_code == 201:
+            if body.digest.hexdigest() != checksum:
+                print(f"⚠️ {name} changed while it was uploaded (sha256 mismatch)")
+            elapsed = time.time() - attempt_start
+            deployment_id = resp.text.strip().replace('"', '')
+            print(f"✅ Uploaded {name} in {elapsed:.1f}s ({format_size(body.length / max(elapsed, 1e-6))}/s). ID: {deployment_id}")
+            return deployment_id
 
-    except Exception as e:
-        print(f"❌ Upload Error: {e}")
+        if resp.status_code == 429 or resp.status_code >= 500:
+            print(f"   ⚠️ Upload rejected ({name}): {resp.status_code} - {resp.text}")
+            continue
+
+        print(f"❌ Upload Failed ({name}): {resp.status_code} - {resp.text}")
+        return None
+
+    print(f"❌ Upload Failed ({name}): giving up after {UPLOAD_RETRIES + 1} attempts")
+    return None
+
+def resolve_bundles(patterns):
+    """Expand bundle paths and glob patterns, keeping order and dropping duplicates"""
+    bundles = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        if not matches:
+            print(f"⚠️ No bundle matches: {pattern}")
+        for path in matches:
+            if path not in bundles:
+                bundles.append(path)
+    return bundles
+
+def report(poller, deployment_id):
+    """Print the outcome of a single deployment"""
+    outcome = poller.outcome[deployment_id]
+    if outcome == 'PUBLISHED':
+        print("\n🎉 PUBLISHED Successfully!")
+        print("✅ Artifacts are live on Maven Central")
+    elif outcome == 'PUBLISHING':
+        elapsed = poller.finished[deployment_id] - poller.start[deployment_id]
+        print(f"\n✅ PUBLISHING in progress ({int(elapsed/60)} minutes)")
+        print("📦 Package validation passed and is being synced to Maven Central")
+        print("⏰ This may take 10-30 minutes to complete")
+        print("🔍 Check status at: https://central.sonatype.com/publishing")
+        print(f"   Deployment ID: {deployment_id}")
+    elif outcome == 'FAILED':
+        print("\n❌ FAILED.")
+        print("Errors:", json.dumps(poller.data[deployment_id].get('errors', {}), indent=2))
+    elif outcome == 'ERROR':
+        print("\n❌ Too many API errors. Aborting.")
+    else:
+        print("\n❌ Timeout.")
+
+def print_summary(bundles, deployments, poller):
+    """Combined result table of a batch"""
+    print("\n" + "="*50)
+    print(f"📊 Summary ({len(bundles)} bundle(s)):\n")
+    print(f"{'Bundle':<50} {'Outcome':<12} {'Time':>8}  ID")
+    for zip_path in bundles:
+        name = os.path.basename(zip_path)
+        deployment_id = deployments.get(zip_path)
+        if not deployment_id:
+            print(f"{name:<50} {'UPLOAD FAIL':<12} {'-':>8}  -")
+            continue
+        outcome = poller.outcome[deployment_id]
+        elapsed = poller.finished[deployment_id] - poller.start[deployment_id]
+        print(f"{name:<50} {outcome:<12} {elapsed:>7.0f}s  {deployment_id}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Publish bundles to the Maven Central Portal')
+    parser.add_argument('bundles', nargs='*',
+                        help='Bundle zip files or glob patterns (default: $ZIP_FILE_PATH)')
+    parser.add_argument('--workers', type=int, default=UPLOAD_WORKERS,
+                        help='Bundles uploaded concurrently')
+    args = parser.parse_args()
+
+    username = os.environ.get('OSSRH_USERNAME')
+    password = os.environ.get('OSSRH_PASSWORD')
+    patterns = args.bundles or [p for p in [os.environ.get('ZIP_FILE_PATH')] if p]
+
+    if not all([username, password, patterns]):
+        print("Error: Missing env vars (OSSRH_USERNAME, OSSRH_PASSWORD, ZIP_FILE_PATH or bundle arguments)")
         sys.exit(1)
 
-    # Cool down
-    print("💤 Waiting 15s for server to process...")
-    time.sleep(15)
+    bundles = resolve_bundles(patterns)
+    if not bundles:
+        print("Error: No bundles to publish")
+        sys.exit(1)
 
-    # ================= 2. Check Status =================
-    status_url = f"{BASE_URL}/status?id={deployment_id}"
-    print(f"⏳ [POST] {status_url} (ID: {deployment_id})")
-    
-    start_time = time.time()
-    consecutive_errors = 0
-    
-    while True:
-        if time.time() - start_time > 1200:  # 20 minutes timeout
-            print("\n❌ Timeout.")
-            drop_deployment(deployment_id, headers)
-            sys.exit(1)
+    auth_str = f"{username}:{password}"
+    b64_auth = base64.b64encode(auth_str.encode()).decode()
+    session = new_session({"Authorization": f"UserToken {b64_auth}"}, pool_size=max(args.workers, DROP_WORKERS, 1) + 2)
 
-        try:
-            status_body = {"deploymentId": deployment_id}
-            status_resp = requests.post(status_url, headers=headers, json=status_body)
-            
-            if DEBUG:
-                debug_log(f"Check Status: {status_resp.status_code}")
-                debug_log(f"Body: {status_resp.text}")
-
-            if status_resp.status_code == 200:
-                consecutive_errors = 0
-                data = status_resp.json()
-                state = data.get('deploymentState', 'UNKNOWN')
-                
-                print(f"   Status: {state}")
-
-                if state == 'PUBLISHED':
-                    print("\n🎉 PUBLISHED Successfully!")
-                    print("✅ Artifacts are live on Maven Central")
-                    sys.exit(0)
-                
-                elif state == 'PUBLISHING':
-                    # Check how long we've been publishing
-                    elapsed = time.time() - start_time
-                    if elapsed > 300:  # After 5 minutes of PUBLISHING, consider it success
-                        print(f"\n✅ PUBLISHING in progress ({int(elapsed/60)} minutes)")
-                        print("📦 Package validation passed and is being synced to Maven Central")
-                        print("⏰ This may take 10-30 minutes to complete")
-                        print("🔍 Check status at: https://central.sonatype.com/publishing")
-                        print(f"   Deployment ID: {deployment_id}")
-                        sys.exit(0)
-                
-                elif state == 'FAILED':
-                    print("\n❌ FAILED.")
-                    print("Errors:", json.dumps(data.get('errors', {}), indent=2))
-                    drop_deployment(deployment_id, headers)
-                    sys.exit(1)
-            else:
-                consecutive_errors += 1
-                print(f"   ⚠️ HTTP {status_resp.status_code}: {status_resp.text}")
-                
-                if consecutive_errors >= 5:
-                    print("\n❌ Too many API errors (500). Aborting.")
-                    drop_deployment(deployment_id, headers)
-                    sys.exit(1)
+    cache = DeploymentCache.for_account(username)
 
-        except Exception as e:
-            print(f"   ⚠️ Exception: {e}")
-            consecutive_errors += 1
+    # ================= 0. Cleanup =================
+    cleanup_failed_deployments(session, cache)
+
+    print("\n" + "="*50)
+
+    # ================= 1. Upload =================
+    print(f"📤 Uploading {len(bundles)} bundle(s) to Maven Central Portal")
+    names = deployment_names(bundles)
+    with ThreadPoolExecutor(max_workers=max(args.workers, 1)) as pool:
+        deployments = dict(zip(bundles, pool.map(lambda path: upload_bundle(session, path, names[path]), bundles)))
+    deployment_ids = [dep_id for dep_id in deployments.values() if dep_id]
+    for zip_path, dep_id in deployments.items():
+        if dep_id:
+            cache.put({'deploymentId': dep_id, 'deploymentName': names[zip_path],
+                       'deploymentState': 'PENDING', 'createTimestamp': int(time.time() * 1000)})
+    cache.save()
+    if not deployment_ids:
+        sys.exit(1)
+
+    # ================= 2. Check Status =================
+    for deployment_id in deployment_ids:
+        print(f"⏳ [POST] {BASE_URL}/status?id={deployment_id} (ID: {deployment_id})")
+    poller = DeploymentPoller(session, deployment_ids, cache=cache)
+    outcomes = poller.run()
+
+    failed = len(bundles) - len(deployment_ids)
+    for deployment_id in deployment_ids:
+        poller.print_timeline(deployment_id)
+        report(poller, deployment_id)
+        if outcomes[deployment_id] not in ('PUBLISHED', 'PUBLISHING'):
+            failed += 1
+            if drop_deployment(deployment_id, session):
+                cache.forget(deployment_id)
+    cache.save()
 
-        time.sleep(10)
+    if len(bundles) > 1:
+        print_summary(bundles, deployments, poller)
+    sys.exit(1 if failed else 0)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()